@@ -5,7 +5,8 @@ Python + Flask implementation
 This file provides example code for generating Superset guest tokens
 from a Python Flask backend with Row-Level Security (RLS) support.
 
-Add this code to your existing server/api/forms_api.py file.
+Add this code to your existing server/api/forms_api.py file, and copy
+the quest_superset/ package next to it (request tracing, RLS helpers).
 """
 
 import requests
@@ -13,6 +14,8 @@ import os
 from flask import request, jsonify
 from functools import wraps
 
+from quest_superset import rls, tracing
+
 # Configuration (use environment variables)
 SUPERSET_URL = os.getenv('SUPERSET_URL', 'http://localhost:8088')
 SUPERSET_USERNAME = os.getenv('SUPERSET_USERNAME', 'admin')
@@ -30,16 +33,18 @@ def get_superset_access_token():
         Exception: If authentication fails
     """
     try:
-        response = requests.post(
-            f'{SUPERSET_URL}/api/v1/security/login',
-            json={
-                'username': SUPERSET_USERNAME,
-                'password': SUPERSET_PASSWORD,
-                'provider': 'db',
-                'refresh': True
-            },
-            timeout=10
-        )
+        with tracing.start_span('superset.login'):
+            response = requests.post(
+                f'{SUPERSET_URL}/api/v1/security/login',
+                json={
+                    'username': SUPERSET_USERNAME,
+                    'password': SUPERSET_PASSWORD,
+                    'provider': 'db',
+                    'refresh': True
+                },
+                headers=tracing.outbound_headers(),
+                timeout=10
+            )
 
         if response.status_code != 200:
             raise Exception(f'Superset authentication failed: {response.text}')
@@ -116,6 +121,12 @@ def require_auth(f):
     return decorated_function
 
 
+# Open a span per request and continue incoming traceparent headers.
+# With TRACING_ENABLED=true, spans are written to TRACE_EXPORT_PATH
+# (default: ./traces.jsonl)
+tracing.init_flask_app(app, service_name='quest-backend')
+
+
 @app.route('/api/superset/guest-token', methods=['POST'])
 @require_auth
 def get_superset_guest_token():
@@ -174,25 +185,31 @@ def get_superset_guest_token():
         }
 
         # 3. Request guest token from Superset
-        response = requests.post(
-            f'{SUPERSET_URL}/api/v1/security/guest_token/',
-            json=guest_token_payload,
-            headers={
-                'Content-Type': 'application/json',
-                'Authorization': f'Bearer {access_token}'
-            },
-            timeout=10
-        )
-
-        if response.status_code != 200:
-            return jsonify({
-                'success': False,
-                'error': 'Failed to generate guest token',
-                'details': response.text
-            }), 500
-
-        # 4. Return guest token to client
-        guest_token = response.json()['token']
+        with tracing.start_span('superset.guest_token', dashboard_id=dashboard_id) as span:
+            response = requests.post(
+                f'{SUPERSET_URL}/api/v1/security/guest_token/',
+                json=guest_token_payload,
+                headers=tracing.outbound_headers({
+                    'Content-Type': 'application/json',
+                    'Authorization': f'Bearer {access_token}'
+                }),
+                timeout=10
+            )
+
+            if response.status_code != 200:
+                return jsonify({
+                    'success': False,
+                    'error': 'Failed to generate guest token',
+                    'details': response.text
+                }), 500
+
+            # 4. Return guest token to client
+            guest_token = response.json()['token']
+
+            # Chart requests made with this token are linked back to this
+            # span by the waterfall tool
+            span.set_attribute('guest_token_fp', tracing.guest_token_fingerprint(guest_token))
+            span.set_attribute('guest_token.issued', True)
 
         return jsonify({
             'success': True,
@@ -234,16 +251,17 @@ def get_superset_dashboards():
         access_token = get_superset_access_token()
 
         # Fetch dashboards
-        response = requests.get(
-            f'{SUPERSET_URL}/api/v1/dashboard/',
-            headers={
-                'Authorization': f'Bearer {access_token}'
-            },
-            params={
-                'q': '{"page":0,"page_size":100,"order_column":"changed_on_delta_humanized","order_direction":"desc"}'
-            },
-            timeout=10
-        )
+        with tracing.start_span('superset.list_dashboards'):
+            response = requests.get(
+                f'{SUPERSET_URL}/api/v1/dashboard/',
+                headers=tracing.outbound_headers({
+                    'Authorization': f'Bearer {access_token}'
+                }),
+                params={
+                    'q': '{"page":0,"page_size":100,"order_column":"changed_on_delta_humanized","order_direction":"desc"}'
+                },
+                timeout=10
+            )
 
         if response.status_code != 200:
             return jsonify({
@@ -304,13 +322,14 @@ def get_superset_dashboard(dashboard_uuid):
         access_token = get_superset_access_token()
 
         # Fetch dashboard details
-        response = requests.get(
-            f'{SUPERSET_URL}/api/v1/dashboard/{dashboard_uuid}',
-            headers={
-                'Authorization': f'Bearer {access_token}'
-            },
-            timeout=10
-        )
+        with tracing.start_span('superset.get_dashboard', dashboard_uuid=dashboard_uuid):
+            response = requests.get(
+                f'{SUPERSET_URL}/api/v1/dashboard/{dashboard_uuid}',
+                headers=tracing.outbound_headers({
+                    'Authorization': f'Bearer {access_token}'
+                }),
+                timeout=10
+            )
 
         if response.status_code != 200:
             return jsonify({
@@ -373,24 +392,38 @@ def generate_advanced_rls_rules(user):
 
 
 # Example: Time-based RLS (show only recent data)
-def generate_time_based_rls(user, days=90):
+def generate_time_based_rls(user, days=90, *, dataset_id, bucket='day',
+                            table='energy_emissions_data', time_column='time', today=None):
     """
     Generate RLS rules that filter by time
 
+    Returns the community rules from generate_rls_rules() plus a time-window
+    rule for one dataset (see quest_superset.rls.time_window_clause).
+
     Args:
-        user (dict): User object
+        user (dict): User object (uses community_id if present, else community)
         days (int): Number of days to look back
+        dataset_id (int): Superset dataset built on ``table``. Required, since
+            the clause names ``table`` and would break charts on other datasets.
+        bucket (str): Boundary alignment, 'day' or 'week'
+        table (str): Table holding the time column
+        time_column (str): Indexed time column
+        today (date): Override for the current UTC date
 
     Returns:
         list: RLS rules with time filter
     """
     rules = generate_rls_rules(user)
 
-    # Add time filter
+    clause = rls.time_window_clause(user, days, bucket, table, time_column, today)
+    if clause is None:
+        # generate_rls_rules() already denies everything
+        return rules
+
     rules.append({
-        'clause': f"created_at >= CURRENT_DATE - INTERVAL '{days} days'"
+        'dataset': dataset_id,
+        'clause': clause
     })
-
     return rules
 
 
@@ -0,0 +1,6 @@
+"""
+Quest Canada - Superset Extensions
+
+Helper modules imported by superset_config.py. The whole package is mounted
+into /app/pythonpath next to the config file (see docker-compose.superset.yml).
+"""
@@ -0,0 +1,252 @@
+"""
+Quest Canada - Single-Flight Data Cache
+
+Redis cache backend for DATA_CACHE_CONFIG that coalesces identical
+concurrent chart queries.
+
+When a popular dashboard is opened by many guests at once, they all miss
+the same data-cache key. With this backend only the first request (the
+leader) gets a miss and runs the query; the others (followers) wait for the
+leader to write the result and return it from the cache.
+
+- The leader holds a Redis lock (SET NX PX) keyed on the cache key. Its
+  lifetime should be at least the query timeout, so it never expires under
+  a leader that is still running.
+- The lock is released when the leader writes the key, or at the end of
+  its request (see release_held_locks), so a failed query does not make
+  followers wait for the full lock timeout.
+- Followers wait as long as the lock exists. Once it is gone without a
+  result, one of them takes over as leader. Only a follower that waits
+  longer than the wait timeout (by default the lock timeout) runs the
+  query alongside the leader.
+
+Counters are kept in Redis; show them with:
+    python -m quest_superset.cache stats
+"""
+
+import logging
+import os
+import secrets
+import sys
+import threading
+import time
+from typing import Dict
+
+from flask_caching.backends.rediscache import RedisCache
+
+from quest_superset import invalidation
+
+logger = logging.getLogger(__name__)
+
+# Compare-and-delete, so a leader never releases a lock it no longer owns
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+# Locks held by the current thread: {lock_key: (client, token)}
+_held = threading.local()
+
+
+def _held_locks() -> Dict:
+    if not hasattr(_held, 'locks'):
+        _held.locks = {}
+    return _held.locks
+
+
+def release_held_locks() -> None:
+    """
+    Release every single-flight lock held by the current thread
+
+    Call at the end of each request (FLASK_APP_MUTATOR does this) so a
+    leader whose query failed hands over to the waiting followers.
+    """
+    locks = _held_locks()
+    while locks:
+        lock_key, (client, token) = locks.popitem()
+        try:
+            client.eval(_RELEASE_SCRIPT, 1, lock_key, token)
+        except Exception as e:
+            logger.warning('Failed to release single-flight lock %s: %s', lock_key, e)
+
+
+class SingleFlightRedisCache(RedisCache):
+    """
+    RedisCache whose misses are coalesced across workers
+
+    Configured through the usual CACHE_REDIS_* keys plus:
+        SINGLE_FLIGHT_LOCK_TIMEOUT: Seconds a leader may hold a key; keep it
+            at least the query timeout (default 300)
+        SINGLE_FLIGHT_WAIT_TIMEOUT: Longest a follower waits for a leader
+            (default: the lock timeout)
+        SINGLE_FLIGHT_POLL_INTERVAL: Longest pause between polls (default 0.2)
+        CACHE_DEPENDENCY_INDEX: Index keys for quest_superset.invalidation
+        CACHE_UNINDEXED_TIMEOUT: Longest timeout for a result the index
+            cannot track, e.g. one reading no watched table (default 300)
+    """
+
+    lock_timeout = 300.0
+    wait_timeout = None
+    poll_interval = 0.2
+    index_dependencies = False
+    unindexed_timeout = 300
+
+    @classmethod
+    def factory(cls, app, config, args, kwargs):
+        cache = super().factory(app, config, args, kwargs)
+        cache.lock_timeout = float(config.get('SINGLE_FLIGHT_LOCK_TIMEOUT', cls.lock_timeout))
+        wait_timeout = config.get('SINGLE_FLIGHT_WAIT_TIMEOUT', cls.wait_timeout)
+        cache.wait_timeout = float(wait_timeout) if wait_timeout is not None else None
+        cache.poll_interval = float(config.get('SINGLE_FLIGHT_POLL_INTERVAL', cls.poll_interval))
+        cache.index_dependencies = bool(config.get('CACHE_DEPENDENCY_INDEX', cls.index_dependencies))
+        cache.unindexed_timeout = int(config.get('CACHE_UNINDEXED_TIMEOUT', cls.unindexed_timeout))
+        return cache
+
+    def _lock_key(self, key: str) -> str:
+        return f'{self._get_prefix()}singleflight:{key}'
+
+    @property
+    def stats_key(self) -> str:
+        return f'{self._get_prefix()}singleflight_stats'
+
+    def _count(self, field: str) -> None:
+        try:
+            self._write_client.hincrby(self.stats_key, field, 1)
+        except Exception as e:
+            logger.debug('Failed to record single-flight %s: %s', field, e)
+
+    def _try_lead(self, key: str) -> bool:
+        lock_key = self._lock_key(key)
+        token = secrets.token_hex(8)
+        if self._write_client.set(lock_key, token, nx=True, px=int(self.lock_timeout * 1000)):
+            _held_locks()[lock_key] = (self._write_client, token)
+            return True
+        return False
+
+    def _release(self, key: str) -> None:
+        lock_key = self._lock_key(key)
+        held = _held_locks().pop(lock_key, None)
+        if held is not None:
+            client, token = held
+            try:
+                client.eval(_RELEASE_SCRIPT, 1, lock_key, token)
+            except Exception as e:
+                # The lock still expires after lock_timeout
+                logger.warning('Failed to release single-flight lock %s: %s', lock_key, e)
+
+    def get(self, key: str):
+        value = super().get(key)
+        if value is not None:
+            return value
+
+        # This thread is already computing the key (e.g. a has() then get())
+        if self._lock_key(key) in _held_locks():
+            return None
+
+        try:
+            if self._try_lead(key):
+                self._count('leader')
+                return None
+
+            wait_timeout = self.lock_timeout if self.wait_timeout is None else self.wait_timeout
+            deadline = time.monotonic() + wait_timeout
+            pause = 0.025
+            while time.monotonic() < deadline:
+                time.sleep(pause)
+                pause = min(pause * 2, self.poll_interval)
+
+                value = super().get(key)
+                if value is not None:
+                    # One query execution saved
+                    self._count('coalesced')
+                    return value
+
+                # The lock is gone without a result (leader failed or
+                # released it); take over. Fails while the lock exists.
+                if self._try_lead(key):
+                    self._count('takeover')
+                    return None
+        except Exception as e:
+            # Never fail a chart because coordination is unavailable
+            logger.warning('Single-flight coordination failed for %s: %s', key, e)
+            return None
+
+        self._count('wait_timeout')
+        return None
+
+    def _short_timeout(self, timeout) -> int:
+        timeout = self.default_timeout if timeout is None else timeout
+        if not timeout or timeout > self.unindexed_timeout:
+            return self.unindexed_timeout
+        return timeout
+
+    def set(self, key: str, value, timeout=None):
+        try:
+            if not self.index_dependencies:
+                return super().set(key, value, timeout)
+
+            # Nothing would evict it, so don't keep it for the long timeout
+            dependencies = invalidation.cache_dependencies(value)
+            if not dependencies:
+                return super().set(key, value, self._short_timeout(timeout))
+
+            # Index after writing: an eviction that runs in between still
+            # finds the key on its second pass (see invalidation.REPEAT_SECONDS)
+            result = super().set(key, value, timeout)
+            timeout = self.default_timeout if timeout is None else timeout
+            if result and not invalidation.index_cache_entry(self, key, dependencies, timeout):
+                try:
+                    self._write_client.expire(f'{self._get_prefix()}{key}', self._short_timeout(timeout))
+                except Exception as e:
+                    logger.warning('Failed to shorten unindexed cache key %s: %s', key, e)
+            return result
+        finally:
+            self._release(key)
+
+    def delete(self, key: str):
+        try:
+            return super().delete(key)
+        finally:
+            self._release(key)
+
+    def stats(self) -> Dict[str, int]:
+        raw = self._read_client.hgetall(self.stats_key)
+        return {
+            (k.decode() if isinstance(k, bytes) else k): int(v)
+            for k, v in raw.items()
+        }
+
+
+def main(argv=None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] not in (['stats'], ['reset']):
+        print('Usage: python -m quest_superset.cache stats|reset')
+        return 2
+
+    cache = SingleFlightRedisCache(
+        host=os.getenv('REDIS_HOST', 'superset-redis'),
+        port=int(os.getenv('REDIS_PORT', 6379)),
+        db=int(os.getenv('DATA_CACHE_REDIS_DB', 1)),
+        key_prefix=os.getenv('DATA_CACHE_KEY_PREFIX', 'superset_'),
+    )
+    if argv[0] == 'reset':
+        cache._write_client.delete(cache.stats_key)
+        print('Single-flight counters reset')
+        return 0
+
+    stats = cache.stats()
+    misses = stats.get('leader', 0) + stats.get('takeover', 0) + stats.get('wait_timeout', 0)
+    saved = stats.get('coalesced', 0)
+    print(f"leader misses      {stats.get('leader', 0)}")
+    print(f"coalesced waits    {saved}")
+    print(f"leader takeovers   {stats.get('takeover', 0)}")
+    print(f"wait timeouts      {stats.get('wait_timeout', 0)}")
+    if misses + saved:
+        print(f'executions saved   {saved} of {misses + saved} misses ({saved / (misses + saved):.0%})')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
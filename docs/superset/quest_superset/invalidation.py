@@ -0,0 +1,650 @@
+"""
+Quest Canada - Event-Driven Cache Invalidation
+
+Evicts exactly the Superset data-cache entries affected by a data change,
+so cache timeouts can be hours instead of minutes.
+
+1. Triggers on the assessment, project and emissions tables send
+   ``pg_notify('quest_data_changed', {"table": ..., "community_id": ...})``.
+   Identical payloads are delivered once per transaction, so a bulk import
+   produces one notification per table and community.
+2. When SingleFlightRedisCache stores a chart result it also indexes the
+   cache key by the tables its SQL reads and, for a table the query
+   restricts to one community (e.g. by guest token RLS), by that community.
+   Results that read no watched table keep a short timeout.
+3. The listener (``python -m quest_superset.invalidation listen``) batches
+   notifications, refreshes the emissions rollups if their source changed,
+   and deletes only the cache keys indexed under the changed tables and
+   communities. It evicts the same keys again after REPEAT_SECONDS, so
+   results from queries that were already running, or that read a lagging
+   replica, do not survive the change. While idle it prunes index members
+   whose cache entry has expired.
+
+Install the triggers once (needs table owner rights):
+    INVALIDATION_DATABASE_URI=... python -m quest_superset.invalidation install
+"""
+
+import json
+import logging
+import os
+import re
+import select
+import sys
+import time
+from collections import defaultdict, deque
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from quest_superset import rollups
+
+logger = logging.getLogger(__name__)
+
+try:
+    import sqlglot
+    from sqlglot import exp
+except ImportError:  # pragma: no cover - every entry is indexed unscoped
+    sqlglot = None
+    exp = None
+
+CHANNEL = 'quest_data_changed'
+
+# Watched table -> how to find the community of a changed row:
+#   'community_id'            column on the row itself
+#   ('assessments', 'assessment_id')  parent table and foreign key
+#   None                      affects every community
+# Tables missing from the database are skipped by install_triggers(), so
+# both the app schema (schema.prisma) and the docs/database SQL schema are
+# listed.
+WATCHED_TABLES = {
+    'communities': None,
+    'assessments': 'community_id',
+    'indicator_scores': ('assessments', 'assessment_id'),
+    'strengths': ('assessments', 'assessment_id'),
+    'recommendations': ('assessments', 'assessment_id'),
+    'projects': 'community_id',
+    'funding': ('projects', 'project_id'),
+    'milestones': ('projects', 'project_id'),
+    'energy_emissions_data': 'community_id',
+    'benchmark_assessments': 'community_id',
+    'benchmark_indicators': None,
+    'benchmark_measures': None,
+    'benchmark_scores': ('benchmark_assessments', 'assessment_id'),
+    'benchmark_measure_responses': ('benchmark_assessments', 'assessment_id'),
+    'benchmark_strengths': ('benchmark_assessments', 'assessment_id'),
+    'benchmark_recommendations': ('benchmark_assessments', 'assessment_id'),
+    'community_projects': 'community_id',
+    'project_tags': ('community_projects', 'project_id'),
+    'project_milestones': ('community_projects', 'project_id'),
+    'project_funding_sources': ('community_projects', 'project_id'),
+    'project_partners': ('community_projects', 'project_id'),
+    'project_documents': ('community_projects', 'project_id'),
+    'project_updates': ('community_projects', 'project_id'),
+    'project_recommendation_links': ('community_projects', 'project_id'),
+    'project_metrics': ('community_projects', 'project_id'),
+}
+
+# Rollups and views -> the watched tables they read. Only a single-source
+# rollup passes a community restriction on to its source table.
+DERIVED_TABLES = {rollup.table: (rollups.SOURCE_TABLE,) for rollup in rollups.ROLLUPS}
+DERIVED_TABLES.update({
+    'active_projects_summary': ('community_projects', 'communities'),
+    'project_portfolio_by_community': ('communities', 'community_projects'),
+    'projects_by_sector_summary': ('community_projects',),
+    'project_funding_gap_analysis': ('community_projects', 'communities'),
+    'provincial_project_statistics': ('communities', 'community_projects'),
+    'overdue_projects': ('community_projects', 'communities'),
+    'projects_addressing_recommendations': (
+        'project_recommendation_links', 'community_projects', 'benchmark_recommendations',
+        'benchmark_assessments', 'benchmark_indicators', 'communities',
+    ),
+    # docs/database/quest_canada_current_schema.sql; the monthly/yearly
+    # views read continuous aggregates of energy_emissions_data
+    'energy_emissions_monthly': ('energy_emissions_data',),
+    'energy_emissions_yearly': ('energy_emissions_data',),
+    'emissions_progress': ('communities', 'energy_emissions_data'),
+    'data_quality_summary': ('energy_emissions_data', 'communities'),
+    'latest_benchmark_assessments': ('communities', 'benchmark_assessments'),
+    'benchmark_indicator_comparison': (
+        'benchmark_scores', 'benchmark_assessments', 'communities', 'benchmark_indicators',
+    ),
+    'provincial_benchmark_averages': (
+        'benchmark_scores', 'benchmark_assessments', 'communities', 'benchmark_indicators',
+    ),
+    'benchmark_progress_tracking': ('communities', 'benchmark_assessments'),
+    'recommendation_implementation_summary': (
+        'benchmark_recommendations', 'benchmark_assessments', 'communities', 'benchmark_indicators',
+    ),
+})
+
+# Wait this long after the last notification before evicting, so one
+# import is handled as one batch (but never longer than BATCH_MAX_SECONDS)
+BATCH_QUIET_SECONDS = float(os.getenv('INVALIDATION_BATCH_QUIET_SECONDS', 2))
+BATCH_MAX_SECONDS = float(os.getenv('INVALIDATION_BATCH_MAX_SECONDS', 10))
+
+# Evict every batch a second time once results computed from pre-change
+# data can no longer be written: the longest chart query plus the most a
+# routed replica may lag (and how long that lag measurement is reused)
+REPEAT_SECONDS = float(os.getenv('INVALIDATION_REPEAT_SECONDS') or (
+    float(os.getenv('SUPERSET_WEBSERVER_TIMEOUT', 300))
+    + float(os.getenv('READ_REPLICA_MAX_LAG_SECONDS', 30))
+    + float(os.getenv('READ_REPLICA_CHECK_INTERVAL', 5))
+))
+
+# Index sets outlive the longest expected cache entry. Every write extends
+# them, so the idle listener prunes members whose entry has gone, at most
+# once per PRUNE_INTERVAL_SECONDS.
+INDEX_TTL_SECONDS = int(os.getenv('INVALIDATION_INDEX_TTL_SECONDS', 7 * 86400))
+PRUNE_INTERVAL_SECONDS = float(os.getenv('INVALIDATION_PRUNE_INTERVAL_SECONDS', 3600))
+PRUNE_BATCH_SIZE = 500
+
+_IDENTIFIER_RE = re.compile(r'[a-z_][a-z0-9_]*')
+
+
+# -------------------------------------------------------------------
+# Triggers
+# -------------------------------------------------------------------
+NOTIFY_FUNCTION_SQL = f"""
+CREATE OR REPLACE FUNCTION quest_notify_change(p_table TEXT, p_community TEXT)
+RETURNS void LANGUAGE sql AS $$
+    SELECT pg_notify('{CHANNEL}', json_build_object('table', p_table, 'community_id', p_community)::text);
+$$
+"""
+
+
+def _community_expr(source, row: str) -> str:
+    if source is None:
+        return 'NULL'
+    if isinstance(source, tuple):
+        parent, foreign_key = source
+        return f'(SELECT community_id::text FROM {parent} WHERE id = {row}.{foreign_key})'
+    return f'{row}.{source}::text'
+
+
+def trigger_sql(table: str, source) -> Tuple[str, ...]:
+    """Trigger function + row and TRUNCATE triggers notifying on every change to ``table``"""
+    function = f'quest_notify_{table}'
+    return (
+        f"""
+CREATE OR REPLACE FUNCTION {function}() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        PERFORM quest_notify_change(TG_TABLE_NAME, NULL);
+        RETURN NULL;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM quest_notify_change(TG_TABLE_NAME, {_community_expr(source, 'NEW')});
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM quest_notify_change(TG_TABLE_NAME, {_community_expr(source, 'OLD')});
+    END IF;
+    RETURN NULL;
+END
+$$
+""",
+        f'DROP TRIGGER IF EXISTS {function} ON {table}',
+        f"""
+CREATE TRIGGER {function}
+AFTER INSERT OR UPDATE OR DELETE ON {table}
+FOR EACH ROW EXECUTE FUNCTION {function}()
+""",
+        f'DROP TRIGGER IF EXISTS {function}_truncate ON {table}',
+        f"""
+CREATE TRIGGER {function}_truncate
+AFTER TRUNCATE ON {table}
+FOR EACH STATEMENT EXECUTE FUNCTION {function}()
+""",
+    )
+
+
+def install_triggers(database_uri: str) -> Set[str]:
+    """
+    Create the notify triggers on every watched table that exists
+
+    Returns:
+        set: Tables that got a trigger
+    """
+    from sqlalchemy import create_engine, text
+
+    installed = set()
+    engine = create_engine(database_uri)
+    with engine.begin() as conn:
+        conn.execute(text(NOTIFY_FUNCTION_SQL))
+        for table, source in WATCHED_TABLES.items():
+            if conn.execute(text('SELECT to_regclass(:t)'), {'t': table}).scalar() is None:
+                logger.info('Skipping %s (table not found)', table)
+                continue
+            for statement in trigger_sql(table, source):
+                conn.execute(text(statement))
+            installed.add(table)
+    engine.dispose()
+    return installed
+
+
+# -------------------------------------------------------------------
+# Dependency index (written by SingleFlightRedisCache.set)
+# -------------------------------------------------------------------
+def _index_key(cache, *parts) -> str:
+    return f"{cache._get_prefix()}deps:{':'.join(str(p) for p in parts)}"
+
+
+def referenced_tables(sql: str) -> Set[str]:
+    """Watched tables a query reads, mapping rollups and views to their sources"""
+    words = set(_IDENTIFIER_RE.findall(sql.lower()))
+    tables = {t for t in WATCHED_TABLES if t in words}
+    for derived, sources in DERIVED_TABLES.items():
+        if derived in words:
+            tables.update(sources)
+    return tables
+
+
+def _conjuncts(node):
+    while isinstance(node, exp.Paren):
+        node = node.this
+    if isinstance(node, exp.And):
+        yield from _conjuncts(node.this)
+        yield from _conjuncts(node.expression)
+    else:
+        yield node
+
+
+def _inside(node, ancestor) -> bool:
+    while node is not None:
+        if node is ancestor:
+            return True
+        node = node.parent
+    return False
+
+
+def _string_or_number(node) -> Optional[str]:
+    return node.this if isinstance(node, exp.Literal) else None
+
+
+def _scope_of(predicate):
+    """(column, 'id' | 'name', values) if the predicate restricts rows to given communities"""
+    if isinstance(predicate, exp.EQ) and isinstance(predicate.this, exp.Column):
+        value = _string_or_number(predicate.expression)
+        column = predicate.this
+        if value is None:
+            return None
+        if column.name == 'community_id':
+            return column, 'id', (value,)
+        if column.name == 'name':
+            # Only a scope if the column belongs to communities (checked by the caller)
+            return column, 'community_name', (value,)
+
+    if isinstance(predicate, exp.In) and isinstance(predicate.this, exp.Column):
+        if predicate.this.name != 'community_id':
+            return None
+        values = [_string_or_number(v) for v in predicate.expressions]
+        if values and None not in values:
+            return predicate.this, 'id', tuple(values)
+        subquery = predicate.args.get('query')
+        inner = subquery.this if subquery is not None else None
+        if isinstance(inner, exp.Select) and not inner.args.get('joins'):
+            source = inner.args.get('from') or inner.args.get('from_')
+            where = inner.args.get('where')
+            if (source is not None and isinstance(source.this, exp.Table)
+                    and source.this.name == 'communities' and where is not None):
+                for conjunct in _conjuncts(where.this):
+                    if (isinstance(conjunct, exp.EQ) and isinstance(conjunct.this, exp.Column)
+                            and conjunct.this.name == 'name'):
+                        value = _string_or_number(conjunct.expression)
+                        if value is not None:
+                            return predicate.this, 'name', (value,)
+    return None
+
+
+def _from_tables(select) -> Optional[Dict[str, str]]:
+    """{alias or name: table} for the FROM/JOIN list, or None if it reads a subquery"""
+    source = select.args.get('from') or select.args.get('from_')
+    if source is None:
+        return None
+    tables = {}
+    for node in [source.this] + [join.this for join in select.args.get('joins') or []]:
+        if not isinstance(node, exp.Table):
+            return None
+        tables[node.alias_or_name] = node.name
+    return tables
+
+
+def community_scopes(sql: str) -> Dict[str, Tuple[str, Tuple[str, ...]]]:
+    """
+    Watched tables a query only reads for given communities
+
+    Returns:
+        dict: {table: ('id' | 'name', values)} - tables not listed may be
+        read for any community
+
+    Only a top-level AND-ed predicate counts (this is how Superset applies
+    RLS), only for the table that owns the predicate column (an unqualified
+    column only when the query reads a single table), never for a table
+    that is read twice, and only when no other subquery could read rows
+    outside it.
+    """
+    if sqlglot is None:
+        return {}
+    try:
+        statements = sqlglot.parse(sql, read='postgres')
+    except Exception:
+        return {}
+    if len(statements) != 1 or not isinstance(statements[0], exp.Select):
+        return {}
+
+    root = statements[0]
+    where = root.args.get('where')
+    aliases = _from_tables(root)
+    if where is None or not aliases:
+        return {}
+
+    found = []
+    for conjunct in _conjuncts(where.this):
+        scope = _scope_of(conjunct)
+        if scope is not None:
+            found.append((conjunct, scope))
+
+    # Any subquery outside the restricting predicates may read other rows
+    conjuncts = [conjunct for conjunct, _ in found]
+    for select in root.find_all(exp.Select):
+        if select is not root and not any(_inside(select, c) for c in conjuncts):
+            return {}
+
+    names = list(aliases.values())
+    scopes = {}
+    for _, (column, kind, values) in found:
+        if column.table:
+            table = aliases.get(column.table)
+        else:
+            table = names[0] if len(names) == 1 else None
+        if table is None or names.count(table) != 1:
+            continue
+
+        if kind == 'community_name':
+            if table != 'communities':
+                continue
+            kind = 'name'
+        sources = DERIVED_TABLES.get(table, (table,))
+        if len(sources) == 1 and sources[0] in WATCHED_TABLES:
+            scopes.setdefault(sources[0], (kind, values))
+    return scopes
+
+
+def cache_dependencies(value) -> Dict[str, Optional[Tuple[str, Tuple[str, ...]]]]:
+    """
+    Watched tables a cached chart result depends on, with their scope
+
+    ``value`` is the dict Superset stores for chart data; its ``query``
+    is the SQL that produced the result.
+
+    Returns:
+        dict: {table: scope or None}; empty if no change would evict it
+    """
+    try:
+        sql = value.get('query') if isinstance(value, dict) else None
+        if not sql:
+            return {}
+        tables = referenced_tables(sql)
+        if not tables:
+            return {}
+        scopes = community_scopes(sql)
+        return {table: scopes.get(table) for table in tables}
+    except Exception as e:
+        logger.warning('Failed to read cache dependencies: %s', e)
+        return {}
+
+
+def index_cache_entry(cache, key: str, dependencies: Dict, timeout: int) -> bool:
+    """
+    Record which tables/communities a cached chart result depends on
+
+    Returns:
+        bool: False if the index could not be written
+    """
+    try:
+        ttl = max(int(timeout or 0), INDEX_TTL_SECONDS)
+        pipe = cache._write_client.pipeline()
+        for table, scope in dependencies.items():
+            sets = [_index_key(cache, table, 'all')]
+            if scope is None:
+                sets.append(_index_key(cache, table, 'unscoped'))
+            else:
+                kind, values = scope
+                sets.extend(_index_key(cache, table, kind, v) for v in values)
+            for set_key in sets:
+                pipe.sadd(set_key, key)
+                pipe.expire(set_key, ttl)
+        pipe.execute()
+        return True
+    except Exception as e:
+        logger.warning('Failed to index cache key %s: %s', key, e)
+        return False
+
+
+# Removes the members (ARGV[2..]) of index set KEYS[1] whose cache entry
+# (ARGV[1] prefix + member) no longer exists. Atomic, so an entry written
+# and re-indexed concurrently is never dropped from the set.
+PRUNE_SCRIPT = """
+local removed = 0
+for i = 2, #ARGV do
+    if redis.call('EXISTS', ARGV[1] .. ARGV[i]) == 0 then
+        removed = removed + redis.call('SREM', KEYS[1], ARGV[i])
+    end
+end
+return removed
+"""
+
+
+# -------------------------------------------------------------------
+# Invalidator
+# -------------------------------------------------------------------
+class CacheInvalidator:
+    """
+    Evict data-cache keys for changed (table, community) pairs
+
+    Args:
+        cache: The data cache (SingleFlightRedisCache) to evict from
+        database_uri (str): Quest Canada database, for community names
+            and rollup refreshes
+        refresh_rollups (bool): Refresh emissions rollups before evicting
+            results that depend on energy_emissions_data
+    """
+
+    def __init__(self, cache, database_uri: str, refresh_rollups: bool = False):
+        from sqlalchemy import create_engine
+
+        self.cache = cache
+        self.database_uri = database_uri
+        self.engine = create_engine(database_uri)
+        self.maintainer = rollups.RollupMaintainer(database_uri) if refresh_rollups else None
+        # Batches awaiting their second eviction: (due, changes), oldest first
+        self._repeats = deque()
+        self._pruned_at = time.monotonic()
+
+    def community_names(self, ids: Iterable[str]) -> Dict[str, str]:
+        from sqlalchemy import text
+
+        ids = [i for i in ids if i is not None]
+        if not ids:
+            return {}
+        with self.engine.connect() as conn:
+            rows = conn.execute(
+                text('SELECT id::text, name FROM communities WHERE id::text = ANY(:ids)'),
+                {'ids': ids},
+            )
+            return {row[0]: row[1] for row in rows}
+
+    def index_sets(self, changes: Dict[str, Set[Optional[str]]]) -> List[str]:
+        """Index sets holding the keys that depend on the changes"""
+        names = self.community_names({c for cs in changes.values() for c in cs})
+        sets = []
+        for table, communities in changes.items():
+            if None in communities:
+                sets.append(_index_key(self.cache, table, 'all'))
+                continue
+            sets.append(_index_key(self.cache, table, 'unscoped'))
+            for community in communities:
+                sets.append(_index_key(self.cache, table, 'id', community))
+                if community in names:
+                    sets.append(_index_key(self.cache, table, 'name', names[community]))
+        return sets
+
+    def invalidate(self, changes: Dict[str, Set[Optional[str]]], repeat: bool = False) -> int:
+        """
+        Evict every cache key depending on the changed tables/communities
+
+        Rollups are refreshed from their change log first, which covers
+        inserts, updates, deletes and truncates of their source.
+
+        Args:
+            changes: {table: community ids (None = any community)}
+            repeat: Second pass for a batch; rollups are not refreshed again
+
+        Returns:
+            int: Number of cache keys deleted
+        """
+        if not repeat and self.maintainer is not None and rollups.SOURCE_TABLE in changes:
+            self.maintainer.refresh()
+
+        sets = self.index_sets(changes)
+        members = self.cache._read_client.sunion(sets)
+        keys = sorted(m.decode() if isinstance(m, bytes) else m for m in members)
+        if keys:
+            # A result stored concurrently re-adds itself to the index after
+            # writing, so removing these members never orphans a live entry
+            prefix = self.cache._get_prefix()
+            pipe = self.cache._write_client.pipeline()
+            pipe.delete(*(f'{prefix}{key}' for key in keys))
+            for set_key in sets:
+                pipe.srem(set_key, *keys)
+            pipe.execute()
+
+        logger.info(
+            '%s %d cache keys for %s', 'Re-invalidated' if repeat else 'Invalidated', len(keys),
+            ', '.join(f"{t}[{','.join(sorted(c or '*' for c in cs))}]" for t, cs in changes.items()),
+        )
+        return len(keys)
+
+    def prune_index(self) -> int:
+        """
+        Remove index members whose cache entry has expired or been deleted
+
+        Returns:
+            int: Number of members removed
+        """
+        client = self.cache._write_client
+        prefix = self.cache._get_prefix()
+        removed = 0
+        for set_key in client.scan_iter(match=_index_key(self.cache, '*'), count=PRUNE_BATCH_SIZE):
+            members = []
+            for member in client.sscan_iter(set_key, count=PRUNE_BATCH_SIZE):
+                members.append(member)
+                if len(members) >= PRUNE_BATCH_SIZE:
+                    removed += client.eval(PRUNE_SCRIPT, 1, set_key, prefix, *members)
+                    members = []
+            if members:
+                removed += client.eval(PRUNE_SCRIPT, 1, set_key, prefix, *members)
+        logger.info('Pruned %d expired cache keys from the index', removed)
+        return removed
+
+    def listen(self) -> None:
+        """Block forever, batching notifications and invalidating"""
+        import psycopg2
+        from sqlalchemy.engine.url import make_url
+
+        url = make_url(self.database_uri)
+        dsn = url.set(drivername='postgresql').render_as_string(hide_password=False)
+        backoff = 1
+        while True:
+            try:
+                conn = psycopg2.connect(dsn)
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute(f'LISTEN {CHANNEL}')
+                logger.info('Listening on %s', CHANNEL)
+                backoff = 1
+                self._consume(conn)
+            except psycopg2.Error as e:
+                logger.warning('Listener connection lost (%s); retrying in %ss', e, backoff)
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 60)
+
+    def _consume(self, conn) -> None:
+        changes = defaultdict(set)
+        first_at = last_at = None
+        while True:
+            timeout = BATCH_QUIET_SECONDS if changes else 60
+            if self._repeats:
+                timeout = max(0, min(timeout, self._repeats[0][0] - time.monotonic()))
+            if select.select([conn], [], [], timeout) != ([], [], []):
+                conn.poll()
+                while conn.notifies:
+                    notify = conn.notifies.pop(0)
+                    try:
+                        payload = json.loads(notify.payload)
+                        changes[payload['table']].add(payload.get('community_id'))
+                    except (ValueError, KeyError):
+                        logger.warning('Ignoring malformed notification: %s', notify.payload)
+                        continue
+                    last_at = time.monotonic()
+                    first_at = first_at or last_at
+
+            now = time.monotonic()
+            if changes and (now - last_at >= BATCH_QUIET_SECONDS or now - first_at >= BATCH_MAX_SECONDS):
+                batch = {table: set(communities) for table, communities in changes.items()}
+                self._run(batch)
+                self._repeats.append((now + REPEAT_SECONDS, batch))
+                changes.clear()
+                first_at = last_at = None
+
+            while self._repeats and self._repeats[0][0] <= time.monotonic():
+                _, batch = self._repeats.popleft()
+                self._run(batch, repeat=True)
+
+            if not changes and time.monotonic() - self._pruned_at >= PRUNE_INTERVAL_SECONDS:
+                self._pruned_at = time.monotonic()
+                try:
+                    self.prune_index()
+                except Exception as e:
+                    logger.exception('Index pruning failed: %s', e)
+
+    def _run(self, batch, repeat: bool = False) -> None:
+        try:
+            self.invalidate(batch, repeat=repeat)
+        except Exception as e:
+            logger.exception('Invalidation failed: %s', e)
+
+
+def main(argv=None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    command = argv[0] if argv else ''
+    if command not in ('install', 'listen'):
+        print('Usage: python -m quest_superset.invalidation install|listen')
+        return 2
+
+    uri = os.getenv('INVALIDATION_DATABASE_URI')
+    if not uri:
+        print('Set INVALIDATION_DATABASE_URI to the Quest Canada database')
+        return 1
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s:%(levelname)s:%(name)s:%(message)s')
+    if command == 'install':
+        tables = install_triggers(uri)
+        print(f"Change notifications installed on: {', '.join(sorted(tables)) or 'no tables'}")
+        return 0
+
+    from quest_superset.cache import SingleFlightRedisCache
+
+    cache = SingleFlightRedisCache(
+        host=os.getenv('REDIS_HOST', 'superset-redis'),
+        port=int(os.getenv('REDIS_PORT', 6379)),
+        db=int(os.getenv('DATA_CACHE_REDIS_DB', 1)),
+        key_prefix=os.getenv('DATA_CACHE_KEY_PREFIX', 'superset_'),
+    )
+    invalidator = CacheInvalidator(
+        cache, uri,
+        refresh_rollups=os.getenv('ROLLUP_ROUTING_ENABLED', 'false').lower() == 'true',
+    )
+    invalidator.listen()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
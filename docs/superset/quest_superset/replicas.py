@@ -0,0 +1,283 @@
+"""
+Quest Canada - Read Replica Routing
+
+Sends read-only chart queries (and, if enabled, SQL Lab queries) for the
+Quest Canada database to Postgres read replicas, used from DB_CONNECTION_MUTATOR in
+superset_config.py.
+
+- Only connections to the configured primary are considered; the Superset
+  metadata database never goes through DB_CONNECTION_MUTATOR.
+- Only chart and dashboard sources are routed, plus requests from
+  embedded dashboards (guest users), which Superset reports without a
+  source. Connection tests, schema browsing and anything else without a
+  source stay on the primary. SQL Lab is only routed when
+  READ_REPLICA_ROUTE_SQL_LAB=true, since DML and CREATE TABLE AS from SQL
+  Lab would fail on a read-only replica.
+- Replicas whose replay lag exceeds the limit (or that cannot be reached)
+  are skipped; with no healthy replica the primary is used. Lag is measured
+  against the primary's current WAL position, so a replica whose WAL
+  receiver has disconnected is seen as falling behind.
+- One thread re-measures an expired lag value while the others keep using
+  the previous one, so a slow or unreachable replica does not stall every
+  request.
+- Routed connections open read-only transactions, so a write that slips
+  through fails instead of silently diverging.
+
+Check replica health from a shell:
+    python -m quest_superset.replicas status
+"""
+
+import itertools
+import logging
+import os
+import sys
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Query sources (superset.utils.core.QuerySource) that only ever read, plus
+# EMBEDDED for source-less queries from embedded dashboards
+READ_ONLY_SOURCES = {'CHART', 'DASHBOARD', 'SQL_LAB', 'EMBEDDED'}
+
+READ_ONLY_OPTION = '-c default_transaction_read_only=on'
+
+PRIMARY_LSN_QUERY = 'SELECT pg_current_wal_lsn()::text'
+
+# Zero once the replica has replayed everything the primary had written
+# when PRIMARY_LSN_QUERY ran; otherwise the age of the last replayed
+# transaction (which keeps growing while the replica is disconnected)
+LAG_QUERY = """
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() THEN 0
+    WHEN pg_wal_lsn_diff(CAST(:primary_lsn AS pg_lsn), pg_last_wal_replay_lsn()) <= 0 THEN 0
+    ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+END
+"""
+
+
+def _split_uris(value: Optional[str]) -> List[str]:
+    return [uri.strip() for uri in (value or '').split(',') if uri.strip()]
+
+
+def _address(url) -> Tuple:
+    return (url.host, url.port or 5432, url.database)
+
+
+def _is_embedded(security_manager) -> bool:
+    """True inside a request from an embedded dashboard"""
+    try:
+        from flask import has_request_context, request
+
+        if not has_request_context():
+            return False
+        if security_manager is not None and security_manager.is_guest_user():
+            return True
+        return '/embedded/' in (request.referrer or '')
+    except Exception:
+        return False
+
+
+def source_name(source, security_manager=None) -> Optional[str]:
+    """
+    Name of the query source used for routing
+
+    Superset derives the source from the request referrer and only knows
+    dashboard, explore and SQL Lab pages; queries from /embedded/ pages
+    arrive with no source and are reported as EMBEDDED.
+    """
+    name = getattr(source, 'name', None)
+    if name is None and _is_embedded(security_manager):
+        return 'EMBEDDED'
+    return name
+
+
+class ReplicaRouter:
+    """
+    Pick a healthy read replica for a primary connection URL
+
+    Args:
+        primary_uri (str): URI of the database whose reads may be offloaded
+            (credentials are ignored; only host, port and database match)
+        replica_uris (list): Replica URIs. Missing username/password are
+            taken from the connection being routed.
+        max_lag_seconds (float): Skip replicas lagging more than this
+        check_interval (float): Seconds a lag measurement is reused
+        route_sql_lab (bool): Also route SQL Lab (off by default). Only
+            enable it with "Allow DML" and "Allow CREATE TABLE AS" off for
+            the database.
+    """
+
+    def __init__(self, primary_uri: str, replica_uris: List[str], max_lag_seconds: float = 30,
+                 check_interval: float = 5, route_sql_lab: bool = False):
+        from sqlalchemy.engine.url import make_url
+
+        self.primary = make_url(primary_uri) if primary_uri else None
+        self.replicas = [make_url(uri) for uri in replica_uris]
+        self.max_lag_seconds = max_lag_seconds
+        self.check_interval = check_interval
+        self.sources = set(READ_ONLY_SOURCES)
+        if not route_sql_lab:
+            self.sources.discard('SQL_LAB')
+
+        self._health: Dict[Tuple, Tuple[float, Optional[float]]] = {}
+        self._probes: Dict[Tuple, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self._counter = itertools.count()
+
+    @property
+    def enabled(self) -> bool:
+        return self.primary is not None and bool(self.replicas)
+
+    def is_primary(self, url) -> bool:
+        return self.enabled and _address(url) == _address(self.primary)
+
+    def _with_credentials(self, replica, url):
+        return replica.set(
+            username=replica.username or url.username,
+            password=replica.password if replica.username else url.password,
+        )
+
+    def _query(self, url, sql: str, **params):
+        from sqlalchemy import create_engine, text
+        from sqlalchemy.pool import NullPool
+
+        engine = create_engine(url, poolclass=NullPool, connect_args={'connect_timeout': 2})
+        try:
+            with engine.connect() as conn:
+                return conn.execute(text(sql), params).scalar()
+        finally:
+            engine.dispose()
+
+    def measure_lag(self, url, primary=None) -> Optional[float]:
+        """
+        Return replication lag in seconds, or None if the replica is down
+
+        Args:
+            url: Replica URL
+            primary: Primary URL (with credentials) to compare against
+
+        A server that is not in recovery (e.g. a second standalone
+        instance used for local testing) reports zero lag. If the primary
+        cannot be reached the lag is unknown and None is returned.
+        """
+        try:
+            primary_lsn = self._query(primary or self.primary, PRIMARY_LSN_QUERY)
+        except Exception as e:
+            logger.warning('Primary unreachable for lag check: %s', e)
+            return None
+        try:
+            lag = self._query(url, LAG_QUERY, primary_lsn=primary_lsn)
+            return float(lag) if lag is not None else None
+        except Exception as e:
+            logger.warning('Replica %s:%s unreachable: %s', url.host, url.port, e)
+            return None
+
+    def lag(self, url, primary=None) -> Optional[float]:
+        """
+        Cached replication lag for a replica URL
+
+        Only one thread measures an expired value; the others return the
+        previous measurement meanwhile (or wait for the first one).
+        """
+        key = _address(url)
+        with self._lock:
+            cached = self._health.get(key)
+            probe = self._probes.setdefault(key, threading.Lock())
+        if cached and time.monotonic() - cached[0] < self.check_interval:
+            return cached[1]
+
+        if not probe.acquire(blocking=cached is None):
+            return cached[1]
+        try:
+            with self._lock:
+                cached = self._health.get(key)
+            if cached and time.monotonic() - cached[0] < self.check_interval:
+                return cached[1]
+
+            lag = self.measure_lag(url, primary)
+            with self._lock:
+                self._health[key] = (time.monotonic(), lag)
+            return lag
+        finally:
+            probe.release()
+
+    def healthy_replicas(self, url) -> List:
+        candidates = [self._with_credentials(r, url) for r in self.replicas]
+        return [
+            r for r in candidates
+            if (lag := self.lag(r, url)) is not None and lag <= self.max_lag_seconds
+        ]
+
+    def route(self, url, source, security_manager=None) -> Tuple[object, bool]:
+        """
+        Choose the URL a connection should use
+
+        Args:
+            url: SQLAlchemy URL Superset is about to connect to
+            source: superset.utils.core.QuerySource (or None)
+            security_manager: Superset security manager, to recognise
+                guest users of embedded dashboards
+
+        Returns:
+            tuple: (url, routed) - ``routed`` is True when a replica was chosen
+        """
+        if not self.is_primary(url) or source_name(source, security_manager) not in self.sources:
+            return url, False
+
+        healthy = self.healthy_replicas(url)
+        if not healthy:
+            logger.warning('No read replica within %ss lag, using primary', self.max_lag_seconds)
+            return url, False
+
+        replica = healthy[next(self._counter) % len(healthy)]
+        return replica, True
+
+
+def mark_read_only(params: Dict) -> Dict:
+    """Force read-only transactions on a routed connection"""
+    connect_args = params.setdefault('connect_args', {})
+    options = connect_args.get('options', '')
+    if READ_ONLY_OPTION not in options:
+        connect_args['options'] = f'{options} {READ_ONLY_OPTION}'.strip()
+    return params
+
+
+def router_from_env() -> ReplicaRouter:
+    """Build a router from READ_REPLICA_* environment variables"""
+    return ReplicaRouter(
+        primary_uri=os.getenv('READ_REPLICA_PRIMARY_URI', ''),
+        replica_uris=_split_uris(os.getenv('READ_REPLICA_URIS')),
+        max_lag_seconds=float(os.getenv('READ_REPLICA_MAX_LAG_SECONDS', 30)),
+        check_interval=float(os.getenv('READ_REPLICA_CHECK_INTERVAL', 5)),
+        route_sql_lab=os.getenv('READ_REPLICA_ROUTE_SQL_LAB', 'false').lower() == 'true',
+    )
+
+
+def main(argv=None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] != ['status']:
+        print('Usage: python -m quest_superset.replicas status')
+        return 2
+
+    router = router_from_env()
+    if not router.enabled:
+        print('Replica routing disabled (set READ_REPLICA_PRIMARY_URI and READ_REPLICA_URIS)')
+        return 1
+
+    print(f'primary  {router.primary.host}:{router.primary.port or 5432}/{router.primary.database}')
+    for replica in router.replicas:
+        lag = router.measure_lag(router._with_credentials(replica, router.primary), router.primary)
+        if lag is None:
+            state = 'DOWN'
+        elif lag > router.max_lag_seconds:
+            state = f'LAGGING ({lag:.1f}s)'
+        else:
+            state = f'ok ({lag:.1f}s)'
+        print(f'replica  {replica.host}:{replica.port or 5432}/{replica.database}  {state}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,87 @@
+"""
+Quest Canada - Time-Window RLS Clauses
+
+Builds the time-window clause used by generate_time_based_rls() in
+examples/python-flask-endpoint.py.
+
+- The clause is table-qualified and compares the indexed time column with a
+  literal boundary, so the planner can use the (community_id, time) index
+  and exclude hypertable chunks at plan time.
+- The boundary is aligned to a day or week, so the clause text (and with it
+  Superset's data-cache keys, which include RLS clauses) only changes once
+  per bucket.
+"""
+
+import re
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+TIME_WINDOW_BUCKETS = ('day', 'week')
+
+_IDENTIFIER_RE = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+
+def time_window_start(days, bucket='day', today=None):
+    """
+    First day of a look-back window, aligned to a bucket boundary
+
+    Args:
+        days (int): Number of days to look back
+        bucket (str): 'day' or 'week' (weeks start on Monday)
+        today (date): Override for the current UTC date
+
+    Returns:
+        date: Window start (inclusive)
+    """
+    if bucket not in TIME_WINDOW_BUCKETS:
+        raise ValueError(f'bucket must be one of {TIME_WINDOW_BUCKETS}, got {bucket!r}')
+
+    today = today or datetime.now(timezone.utc).date()
+    start = today - timedelta(days=int(days))
+    if bucket == 'week':
+        start -= timedelta(days=start.weekday())
+    return start
+
+
+def time_window_clause(user, days=90, bucket='day', table='energy_emissions_data',
+                       time_column='time', today=None) -> Optional[str]:
+    """
+    Clause limiting ``table`` to the user's community and a recent window
+
+    Args:
+        user (dict): User object (uses community_id if present, else community)
+        days (int): Number of days to look back
+        bucket (str): Boundary alignment, 'day' or 'week'
+        table (str): Table holding the time column
+        time_column (str): Indexed time column
+        today (date): Override for the current UTC date
+
+    Returns:
+        str: The clause, e.g.
+
+            energy_emissions_data.community_id = 3
+            AND energy_emissions_data."time" >= TIMESTAMPTZ '2025-07-21 00:00:00+00'
+
+        or None for a non-admin user without a community
+    """
+    for identifier in (table, time_column):
+        if not _IDENTIFIER_RE.match(identifier):
+            raise ValueError(f'Invalid SQL identifier: {identifier!r}')
+
+    start = time_window_start(days, bucket, today)
+    predicates = []
+
+    # Community first, so the (community_id, time) index is fully usable
+    if not (user.get('role') == 'admin' or user.get('is_admin')):
+        if user.get('community_id') is not None:
+            predicates.append(f'{table}.community_id = {int(user["community_id"])}')
+        elif user.get('community'):
+            community = user['community'].replace("'", "''")
+            predicates.append(
+                f"{table}.community_id IN (SELECT id FROM communities WHERE name = '{community}')"
+            )
+        else:
+            return None
+
+    predicates.append(f'{table}."{time_column}" >= TIMESTAMPTZ \'{start.isoformat()} 00:00:00+00\'')
+    return ' AND '.join(predicates)
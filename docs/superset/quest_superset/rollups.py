@@ -0,0 +1,547 @@
+"""
+Quest Canada - Emissions Rollups
+
+Pre-aggregated daily, monthly and yearly copies of energy_emissions_data
+(per community, sector and energy_source), plus the SQL_QUERY_MUTATOR
+rewrite that answers compatible chart queries from them.
+
+Maintenance:
+    python -m quest_superset.rollups create    # tables + change trigger (idempotent)
+    python -m quest_superset.rollups refresh   # recompute changed days (cron / invalidator)
+    python -m quest_superset.rollups rebuild   # full recompute
+
+A trigger on energy_emissions_data records the day bucket of every
+inserted, updated or deleted row (both old and new time on updates) in
+CHANGES_TABLE, and a TRUNCATE requests a full rebuild. ``refresh``
+recomputes exactly those days and the months and years containing them,
+so edits, deletes and backfills of old data are picked up too.
+
+The rewrite only fires when the rollup returns exactly what the raw query
+would: a single-table aggregate over energy_emissions_data that
+- groups/filters only on community_id, sector, energy_source and time,
+- uses time only inside DATE_TRUNC at a grain the rollup can answer, or in
+  ``time >= X`` / ``time < X`` filters with X on a rollup bucket boundary,
+- aggregates with SUM, COUNT or AVG (of NOT NULL measures).
+Anything else - joins, subqueries in FROM, MIN/MAX, DISTINCT aggregates,
+window functions, unaligned time filters - is left untouched.
+
+Rollup buckets are computed in ROLLUP_TIMEZONE (default UTC), which must
+match the analytics database's session time zone.
+"""
+
+import logging
+import os
+import re
+import sys
+from datetime import datetime
+from typing import NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+try:
+    import sqlglot
+    from sqlglot import exp
+except ImportError:  # pragma: no cover - rewrite becomes a no-op
+    sqlglot = None
+    exp = None
+
+SOURCE_TABLE = 'energy_emissions_data'
+TIME_COLUMN = 'time'
+DIMENSIONS = ('community_id', 'sector', 'energy_source')
+MEASURES = ('consumption_gj', 'emissions_tco2e', 'cost_cad')
+NOT_NULL_MEASURES = ('consumption_gj', 'emissions_tco2e')
+# Raw-table columns the rollups drop
+RAW_ONLY_COLUMNS = ('data_source', 'data_quality_score', 'notes', 'created_at')
+CHANGES_TABLE = 'energy_emissions_rollup_changes'
+CHANGE_TRIGGER = 'quest_rollup_track_changes'
+
+ROLLUP_TIMEZONE = os.getenv('ROLLUP_TIMEZONE', 'UTC')
+
+
+class Rollup(NamedTuple):
+    grain: str          # date_trunc unit of the bucket
+    table: str
+    source: str         # table the rollup is recomputed from
+    answers: tuple      # query time grains it can serve exactly
+
+
+# Coarsest first: the rewrite picks the first one that fits
+ROLLUPS = (
+    Rollup('year', 'energy_emissions_rollup_yearly', 'energy_emissions_rollup_monthly',
+           ('year',)),
+    Rollup('month', 'energy_emissions_rollup_monthly', 'energy_emissions_rollup_daily',
+           ('month', 'quarter', 'year')),
+    Rollup('day', 'energy_emissions_rollup_daily', SOURCE_TABLE,
+           ('day', 'week', 'month', 'quarter', 'year')),
+)
+
+
+# -------------------------------------------------------------------
+# Maintenance
+# -------------------------------------------------------------------
+def _rollup_ddl(table: str) -> str:
+    return f"""
+CREATE TABLE IF NOT EXISTS {table} (
+    "time" TIMESTAMPTZ NOT NULL,
+    community_id INTEGER NOT NULL,
+    sector VARCHAR(50) NOT NULL,
+    energy_source VARCHAR(50) NOT NULL,
+    consumption_gj NUMERIC NOT NULL,
+    emissions_tco2e NUMERIC NOT NULL,
+    cost_cad NUMERIC,
+    row_count BIGINT NOT NULL,
+    cost_cad_count BIGINT NOT NULL,
+    PRIMARY KEY (community_id, "time", sector, energy_source)
+);
+CREATE INDEX IF NOT EXISTS {table}_time_idx ON {table} ("time");
+"""
+
+
+def _changes_ddl() -> tuple:
+    """Change-log table plus the triggers that fill it"""
+    timezone = ROLLUP_TIMEZONE.replace("'", "''")
+    day = f"date_trunc('day', {{row}}.\"time\", '{timezone}')"
+    # ON CONFLICT DO UPDATE locks an existing bucket row until the writing
+    # transaction commits, so a refresh cannot consume it early and miss
+    # that transaction's rows. The WHERE keeps it to one update per
+    # transaction during bulk imports.
+    upsert = (f'INSERT INTO {CHANGES_TABLE} (bucket, xid) VALUES ({{bucket}}, txid_current()) '
+              f'ON CONFLICT (bucket) DO UPDATE SET xid = EXCLUDED.xid '
+              f'WHERE {CHANGES_TABLE}.xid <> EXCLUDED.xid')
+    return (
+        f"""
+CREATE TABLE IF NOT EXISTS {CHANGES_TABLE} (
+    bucket TIMESTAMPTZ PRIMARY KEY,   -- changed day; -infinity = rebuild everything
+    xid BIGINT NOT NULL
+)
+""",
+        f"""
+CREATE OR REPLACE FUNCTION {CHANGE_TRIGGER}() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        {upsert.format(bucket="'-infinity'")};
+        RETURN NULL;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        {upsert.format(bucket=day.format(row='NEW'))};
+    END IF;
+    IF TG_OP = 'DELETE' OR (TG_OP = 'UPDATE' AND OLD."time" IS DISTINCT FROM NEW."time") THEN
+        {upsert.format(bucket=day.format(row='OLD'))};
+    END IF;
+    RETURN NULL;
+END
+$$
+""",
+        f'DROP TRIGGER IF EXISTS {CHANGE_TRIGGER} ON {SOURCE_TABLE}',
+        f"""
+CREATE TRIGGER {CHANGE_TRIGGER}
+AFTER INSERT OR UPDATE OR DELETE ON {SOURCE_TABLE}
+FOR EACH ROW EXECUTE FUNCTION {CHANGE_TRIGGER}()
+""",
+        f'DROP TRIGGER IF EXISTS {CHANGE_TRIGGER}_truncate ON {SOURCE_TABLE}',
+        f"""
+CREATE TRIGGER {CHANGE_TRIGGER}_truncate
+AFTER TRUNCATE ON {SOURCE_TABLE}
+FOR EACH STATEMENT EXECUTE FUNCTION {CHANGE_TRIGGER}()
+""",
+    )
+
+
+# Claims every recorded change and merges consecutive days into
+# [start, end) ranges. The -infinity marker comes back as a NULL range.
+CLAIM_CHANGES_SQL = f"""
+WITH claimed AS (
+    DELETE FROM {CHANGES_TABLE} RETURNING bucket
+), runs AS (
+    SELECT bucket, bucket - (ROW_NUMBER() OVER (ORDER BY bucket)) * INTERVAL '1 day' AS run
+    FROM claimed
+    WHERE isfinite(bucket)
+)
+SELECT NULL::timestamptz, NULL::timestamptz WHERE EXISTS (SELECT 1 FROM claimed WHERE NOT isfinite(bucket))
+UNION ALL
+SELECT MIN(bucket), MAX(bucket) + INTERVAL '1 day' FROM runs GROUP BY run
+ORDER BY 1 NULLS FIRST
+"""
+
+
+def _refresh_sql(rollup: Rollup) -> tuple:
+    """DELETE + INSERT recomputing one rollup over [:start, :end), widened to its buckets"""
+    start = f"date_trunc('{rollup.grain}', CAST(:start AS TIMESTAMPTZ))"
+    end = (f"date_trunc('{rollup.grain}', CAST(:end AS TIMESTAMPTZ) - INTERVAL '1 microsecond')"
+           f" + INTERVAL '1 {rollup.grain}'")
+    if rollup.source == SOURCE_TABLE:
+        aggregates = ('SUM(consumption_gj), SUM(emissions_tco2e), SUM(cost_cad), '
+                      'COUNT(*), COUNT(cost_cad)')
+    else:
+        aggregates = ('SUM(consumption_gj), SUM(emissions_tco2e), SUM(cost_cad), '
+                      'SUM(row_count), SUM(cost_cad_count)')
+
+    delete = f'DELETE FROM {rollup.table} WHERE "time" >= {start} AND "time" < {end}'
+    insert = f"""
+INSERT INTO {rollup.table}
+SELECT date_trunc('{rollup.grain}', "time"), community_id, sector, energy_source, {aggregates}
+FROM {rollup.source}
+WHERE "time" >= {start} AND "time" < {end}
+GROUP BY 1, 2, 3, 4
+"""
+    return delete, insert
+
+
+class RollupMaintainer:
+    """
+    Create and refresh the emissions rollups
+
+    Args:
+        database_uri (str): SQLAlchemy URI of the Quest Canada database
+            (needs write access, unlike the Superset connection)
+    """
+
+    def __init__(self, database_uri: str):
+        from sqlalchemy import create_engine
+
+        self.engine = create_engine(database_uri)
+
+    def _begin(self):
+        from sqlalchemy import text
+
+        conn = self.engine.connect()
+        trans = conn.begin()
+        conn.execute(text('SELECT set_config(\'TimeZone\', :tz, true)'), {'tz': ROLLUP_TIMEZONE})
+        # One refresh at a time
+        conn.execute(text(f"SELECT pg_advisory_xact_lock(hashtext('{CHANGES_TABLE}'))"))
+        return conn, trans
+
+    def create(self) -> None:
+        """
+        Create the rollup tables and change trigger
+
+        Also queues a full rebuild, so the next refresh fills the rollups
+        (re-running it after an upgrade is safe).
+        """
+        from sqlalchemy import text
+
+        with self.engine.begin() as conn:
+            for rollup in reversed(ROLLUPS):
+                for statement in _rollup_ddl(rollup.table).split(';'):
+                    if statement.strip():
+                        conn.execute(text(statement))
+            for statement in _changes_ddl():
+                conn.execute(text(statement))
+            conn.execute(text(
+                f"INSERT INTO {CHANGES_TABLE} (bucket, xid) VALUES ('-infinity', txid_current()) "
+                f"ON CONFLICT (bucket) DO NOTHING"
+            ))
+
+    def refresh_range(self, conn, start, end) -> None:
+        """Recompute all rollups for source rows with start <= time < end"""
+        from sqlalchemy import text
+
+        for rollup in reversed(ROLLUPS):
+            for statement in _refresh_sql(rollup):
+                conn.execute(text(statement), {'start': start, 'end': end})
+
+    def refresh(self, full: bool = False) -> Optional[tuple]:
+        """
+        Recompute the days recorded in CHANGES_TABLE
+
+        Every changed day is recomputed from the source, along with the
+        months and years containing it. A TRUNCATE of the source (or
+        ``full=True``) rebuilds everything.
+
+        Returns:
+            tuple: (start, end) spanning the recomputed time ranges, or None
+        """
+        from sqlalchemy import text
+
+        conn, trans = self._begin()
+        try:
+            ranges = [tuple(row) for row in conn.execute(text(CLAIM_CHANGES_SQL))]
+            if ranges and ranges[0][0] is None:
+                full = True
+
+            if full:
+                for rollup in ROLLUPS:
+                    conn.execute(text(f'TRUNCATE {rollup.table}'))
+                row = conn.execute(text(f"""
+                    SELECT MIN(date_trunc('day', "time")), MAX(date_trunc('day', "time")) + INTERVAL '1 day'
+                    FROM {SOURCE_TABLE}
+                """)).one()
+                ranges = [tuple(row)] if row[0] is not None else []
+
+            for start, end in ranges:
+                self.refresh_range(conn, start, end)
+            trans.commit()
+        except Exception:
+            trans.rollback()
+            raise
+        finally:
+            conn.close()
+
+        if not ranges:
+            return None
+        start, end = ranges[0][0], ranges[-1][1]
+        logger.info('Refreshed emissions rollups for %s .. %s (%d ranges)', start, end, len(ranges))
+        return start, end
+
+
+# -------------------------------------------------------------------
+# Query rewrite (SQL_QUERY_MUTATOR)
+# -------------------------------------------------------------------
+class _NotRewritable(Exception):
+    pass
+
+
+_DATETIME_RE = re.compile(
+    r'^(\d{4})-(\d{2})-(\d{2})'
+    r'(?:[ T](\d{2}):(\d{2})(?::(\d{2})(?:\.(\d+))?)?)?'
+    r'\s*(Z|[+-]\d{2}(?::?\d{2})?)?$'
+)
+
+_GRAIN_ALIASES = {'dd': 'day', 'days': 'day', 'weeks': 'week', 'months': 'month',
+                  'mon': 'month', 'qtr': 'quarter', 'years': 'year', 'yy': 'year'}
+
+
+def _bucket_aligned(value: str, grain: str) -> bool:
+    """True if a timestamp literal falls exactly on a rollup bucket boundary"""
+    match = _DATETIME_RE.match(value.strip())
+    if not match:
+        return False
+    year, month, day, hour, minute, second, fraction, offset = match.groups()
+    if offset is not None:
+        # Offsets are only comparable when buckets are cut in UTC
+        if ROLLUP_TIMEZONE.upper() != 'UTC' or offset.strip('Z+-:0'):
+            return False
+    try:
+        datetime(int(year), int(month), int(day))
+    except ValueError:
+        return False
+    if any(part and int(part) for part in (hour, minute, second, fraction)):
+        return False
+    if grain in ('month', 'year') and int(day) != 1:
+        return False
+    if grain == 'year' and int(month) != 1:
+        return False
+    return True
+
+
+def _is_time_column(node) -> bool:
+    return isinstance(node, exp.Column) and node.name == TIME_COLUMN
+
+
+def _timestamp_literal(node) -> Optional[str]:
+    """The string inside a constant timestamp expression, e.g. TO_TIMESTAMP('...', fmt)"""
+    allowed = (exp.Literal, exp.Cast, exp.DataType, exp.StrToTime, exp.TimeStrToTime,
+               exp.StrToDate, exp.Anonymous, exp.Paren)
+    if any(not isinstance(n, allowed) for n in node.walk()):
+        return None
+    if isinstance(node, exp.Anonymous) and node.name.lower() not in ('to_timestamp', 'to_date'):
+        return None
+    for literal in node.find_all(exp.Literal):
+        if literal.is_string and _DATETIME_RE.match(literal.this.strip()):
+            return literal.this
+    return None
+
+
+def _trunc_grain(node) -> Optional[str]:
+    truncs = tuple(t for t in (getattr(exp, 'TimestampTrunc', None), getattr(exp, 'DateTrunc', None)) if t)
+    if not isinstance(node, truncs) or not _is_time_column(node.this):
+        return None
+    unit = node.args.get('unit')
+    name = (unit.name if unit is not None else '').lower()
+    return _GRAIN_ALIASES.get(name, name)
+
+
+class _QueryShape:
+    """What a SELECT needs from a rollup: time grains, boundary literals, aggregates"""
+
+    def __init__(self, select):
+        self.select = select
+        self.grains = set()
+        self.boundaries = []
+        self.aggregates = []
+        self._inspect()
+
+    def _outer(self, node) -> bool:
+        return node.find_ancestor(exp.Select) is self.select
+
+    def _inspect(self) -> None:
+        select = self.select
+        if select.args.get('joins') or select.args.get('with') or select.find(exp.Window):
+            raise _NotRewritable('joins, CTEs and window functions are not supported')
+
+        source = select.args.get('from') or select.args.get('from_')
+        table = source.this if source is not None else None
+        if not isinstance(table, exp.Table) or table.name != SOURCE_TABLE:
+            raise _NotRewritable('not a plain energy_emissions_data query')
+        self.table = table
+
+        aliases = {e.alias for e in select.expressions if e.alias}
+        order = select.args.get('order')
+
+        for agg in select.find_all(exp.AggFunc):
+            if self._outer(agg):
+                self.aggregates.append(agg)
+        for agg in self.aggregates:
+            self._check_aggregate(agg)
+        if not self.aggregates and not select.args.get('group'):
+            raise _NotRewritable('row-level queries are not rewritten')
+
+        for column in select.find_all(exp.Column):
+            if not self._outer(column) or column.find_ancestor(exp.AggFunc):
+                continue
+            if column.name in DIMENSIONS:
+                continue
+            if order is not None and column.find_ancestor(exp.Order) is order and column.name in aliases:
+                continue
+            if column.name != TIME_COLUMN:
+                raise _NotRewritable(f'column {column.name} is not in the rollups')
+
+            grain = _trunc_grain(column.parent)
+            if grain:
+                self.grains.add(grain)
+                continue
+
+            comparison = column.parent
+            if isinstance(comparison, (exp.GTE, exp.LT)) and comparison.this is column:
+                other = comparison.expression
+            elif isinstance(comparison, (exp.LTE, exp.GT)) and comparison.expression is column:
+                other = comparison.this
+            else:
+                raise _NotRewritable('time used outside DATE_TRUNC or a >= / < filter')
+            literal = _timestamp_literal(other)
+            if literal is None:
+                raise _NotRewritable('time filtered against a non-constant value')
+            self.boundaries.append(literal)
+
+        self._check_subqueries()
+
+    def _check_subqueries(self) -> None:
+        """Reject subqueries that may read the outer emissions rows"""
+        outer_names = {self.table.alias_or_name, SOURCE_TABLE}
+        for column in self.select.find_all(exp.Column):
+            if self._outer(column):
+                continue
+            if column.table:
+                if column.table in outer_names:
+                    raise _NotRewritable(f'subquery references {column.table}.{column.name}')
+            elif column.name not in DIMENSIONS and column.name in (
+                    MEASURES + RAW_ONLY_COLUMNS + (TIME_COLUMN,)):
+                # Unqualified, so it may resolve to the outer row; only
+                # dimensions have the same value in the rollup
+                raise _NotRewritable(f'subquery column {column.name} may reference the outer row')
+
+    def _check_aggregate(self, agg) -> None:
+        if agg.find(exp.Distinct):
+            raise _NotRewritable('DISTINCT aggregates are not supported')
+        arg = agg.this
+        if isinstance(agg, exp.Count) and isinstance(arg, exp.Star):
+            return
+        if not isinstance(arg, exp.Column):
+            raise _NotRewritable('aggregates must be over a plain column')
+        if isinstance(agg, exp.Sum) and arg.name in MEASURES:
+            return
+        if isinstance(agg, exp.Count) and arg.name in MEASURES + DIMENSIONS + (TIME_COLUMN,):
+            return
+        if isinstance(agg, exp.Avg) and arg.name in NOT_NULL_MEASURES:
+            return
+        raise _NotRewritable(f'{agg.sql()} cannot be answered from the rollups')
+
+    def fits(self, rollup: Rollup) -> bool:
+        return (all(g in rollup.answers for g in self.grains)
+                and all(_bucket_aligned(b, rollup.grain) for b in self.boundaries))
+
+
+def _row_count(column_name: str):
+    # COUNT over no rows is 0, SUM over no rows is NULL
+    return exp.Coalesce(
+        this=exp.Cast(
+            this=exp.Sum(this=exp.column(column_name)),
+            to=exp.DataType.build('BIGINT'),
+        ),
+        expressions=[exp.Literal.number(0)],
+    )
+
+
+def _rewrite_aggregate(agg):
+    arg = agg.this
+    if isinstance(agg, exp.Count):
+        if isinstance(arg, exp.Column) and arg.name == 'cost_cad':
+            return _row_count('cost_cad_count')
+        return _row_count('row_count')
+    if isinstance(agg, exp.Avg):
+        return exp.Div(
+            this=exp.Sum(this=arg.copy()),
+            expression=exp.Sum(this=exp.column('row_count')),
+            typed=True,
+        )
+    return agg
+
+
+def rewrite_for_rollup(sql: str) -> str:
+    """
+    Point an exactly-answerable emissions aggregate at the coarsest rollup
+
+    Returns the original SQL unchanged when sqlglot is unavailable, the
+    query does not reference energy_emissions_data, or any part of it
+    cannot be answered exactly from a rollup.
+    """
+    if sqlglot is None or SOURCE_TABLE not in sql.lower():
+        return sql
+
+    try:
+        statements = sqlglot.parse(sql, read='postgres')
+        if len(statements) != 1 or not isinstance(statements[0], exp.Select):
+            return sql
+        select = statements[0]
+        shape = _QueryShape(select)
+    except _NotRewritable as e:
+        logger.debug('Rollup rewrite skipped: %s', e)
+        return sql
+    except Exception as e:
+        logger.debug('Rollup rewrite could not parse query: %s', e)
+        return sql
+
+    rollup = next((r for r in ROLLUPS if shape.fits(r)), None)
+    if rollup is None:
+        return sql
+
+    for agg in shape.aggregates:
+        replacement = _rewrite_aggregate(agg)
+        if replacement is not agg:
+            agg.replace(replacement)
+
+    # Keep the original name as the alias so qualified column references still resolve
+    table = shape.table
+    alias = table.alias or SOURCE_TABLE
+    table.replace(exp.table_(rollup.table, db=table.args.get('db'), alias=alias))
+
+    logger.debug('Rewrote emissions query to %s', rollup.table)
+    return select.sql(dialect='postgres')
+
+
+def main(argv=None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    command = argv[0] if argv else ''
+    if command not in ('create', 'refresh', 'rebuild'):
+        print('Usage: python -m quest_superset.rollups create|refresh|rebuild')
+        return 2
+
+    uri = os.getenv('ROLLUP_DATABASE_URI')
+    if not uri:
+        print('Set ROLLUP_DATABASE_URI to the Quest Canada database')
+        return 1
+
+    logging.basicConfig(level=logging.INFO)
+    maintainer = RollupMaintainer(uri)
+    if command == 'create':
+        maintainer.create()
+        print('Rollup tables ready')
+        return 0
+
+    refreshed = maintainer.refresh(full=command == 'rebuild')
+    print(f'Refreshed {refreshed[0]} .. {refreshed[1]}' if refreshed else 'Rollups already up to date')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
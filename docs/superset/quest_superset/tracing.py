@@ -0,0 +1,403 @@
+"""
+Quest Canada - Request Tracing
+
+Lightweight trace-id propagation shared by the backend guest token endpoint
+(examples/python-flask-endpoint.py) and Superset (superset_config.py).
+
+- Trace context travels in the W3C ``traceparent`` header.
+- Tracing is off unless TRACING_ENABLED=true. Spans are then appended as
+  JSON lines to a local file (no tracing service), which is rotated once it
+  reaches TRACE_EXPORT_MAX_BYTES.
+- SQL sent to the analytics database carries the traceparent as a trailing
+  comment, so it also shows up in Postgres logs and pg_stat_activity.
+- Embedded dashboards call Superset from the browser, not from the backend,
+  so those requests cannot carry our header. Instead both sides record a
+  fingerprint of the guest token, and the offline waterfall tool
+  (quest_superset/waterfall.py) joins the traces on it.
+
+This module only depends on the standard library (plus Flask / psycopg2
+when the matching helpers are used).
+"""
+
+import contextvars
+import functools
+import hashlib
+import json
+import logging
+import os
+import re
+import secrets
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+TRACEPARENT_HEADER = 'traceparent'
+TRACE_ID_RESPONSE_HEADER = 'X-Trace-Id'
+GUEST_TOKEN_HEADER = 'X-GuestToken'
+
+# Where spans are written (one JSON object per line)
+TRACE_EXPORT_PATH = os.getenv('TRACE_EXPORT_PATH', 'traces.jsonl')
+
+# Past this size the file is renamed to <path>.1 (replacing the previous
+# one), so at most twice this much is kept on disk
+TRACE_EXPORT_MAX_BYTES = int(os.getenv('TRACE_EXPORT_MAX_BYTES', 50 * 1024 * 1024))
+
+# Every helper is a no-op unless TRACING_ENABLED=true
+TRACING_ENABLED = os.getenv('TRACING_ENABLED', 'false').lower() == 'true'
+
+# Requests that never get a span (static assets, health checks)
+UNTRACED_PATH_PREFIXES = ('/static/', '/favicon.ico', '/health', '/healthcheck', '/ping')
+
+_TRACEPARENT_RE = re.compile(
+    r'^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$'
+)
+_SQL_COMMENT_RE = re.compile(r"/\*traceparent='([^']*)'\*/")
+
+_current_span = contextvars.ContextVar('quest_current_span', default=None)
+
+
+# -------------------------------------------------------------------
+# Trace context
+# -------------------------------------------------------------------
+def new_trace_id() -> str:
+    return secrets.token_hex(16)
+
+
+def new_span_id() -> str:
+    return secrets.token_hex(8)
+
+
+def parse_traceparent(value: Optional[str]) -> Optional[Tuple[str, str]]:
+    """
+    Parse a W3C traceparent header
+
+    Returns:
+        tuple: (trace_id, parent_span_id), or None if missing/invalid
+    """
+    if not value:
+        return None
+    match = _TRACEPARENT_RE.match(value.strip().lower())
+    if not match:
+        return None
+    trace_id, span_id, _flags = match.groups()
+    if trace_id == '0' * 32 or span_id == '0' * 16:
+        return None
+    return trace_id, span_id
+
+
+def format_traceparent(trace_id: str, span_id: str) -> str:
+    return f'00-{trace_id}-{span_id}-01'
+
+
+def guest_token_fingerprint(token: Optional[str]) -> Optional[str]:
+    """
+    Short, non-reversible id for a guest token
+
+    Recorded on both the span that issued the token and the Superset
+    requests that present it, so the waterfall tool can link them.
+    """
+    if not token:
+        return None
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()[:16]
+
+
+# -------------------------------------------------------------------
+# Exporter
+# -------------------------------------------------------------------
+class FileSpanExporter:
+    """
+    Append finished spans to a JSON-lines file
+
+    Each span is written with a single O_APPEND write, so several gunicorn
+    workers can share one file without interleaving lines. Once the file
+    reaches ``max_bytes`` it is renamed to ``<path>.1``; a worker that
+    still has the old file open finishes its line there.
+    """
+
+    def __init__(self, path: str, max_bytes: int = TRACE_EXPORT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def export(self, record: Dict) -> None:
+        line = (json.dumps(record, default=str, separators=(',', ':')) + '\n').encode('utf-8')
+        try:
+            with self._lock:
+                fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                try:
+                    os.write(fd, line)
+                    if self.max_bytes and os.fstat(fd).st_size >= self.max_bytes:
+                        self._rotate(fd)
+                finally:
+                    os.close(fd)
+        except OSError as e:
+            # Tracing must never break the request it is observing
+            logger.warning('Failed to export span to %s: %s', self.path, e)
+
+    def _rotate(self, fd: int) -> None:
+        try:
+            # Another worker may have rotated already
+            if os.stat(self.path).st_ino == os.fstat(fd).st_ino:
+                os.replace(self.path, f'{self.path}.1')
+        except FileNotFoundError:
+            pass
+
+
+_exporter = FileSpanExporter(TRACE_EXPORT_PATH)
+_service_name = os.getenv('TRACE_SERVICE_NAME', 'quest')
+
+
+def configure(service_name: Optional[str] = None, export_path: Optional[str] = None) -> None:
+    """Set the service name stamped on spans and/or the export file"""
+    global _exporter, _service_name
+    if service_name:
+        _service_name = service_name
+    if export_path:
+        _exporter = FileSpanExporter(export_path)
+
+
+# -------------------------------------------------------------------
+# Spans
+# -------------------------------------------------------------------
+class Span:
+    """
+    A timed unit of work, exported when it ends
+
+    Use as a context manager (``with start_span('name') as span:``); while
+    open it is the current span, so nested spans and outbound headers pick
+    up its trace id automatically.
+    """
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str] = None,
+                 attributes: Optional[Dict] = None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = new_span_id()
+        self.parent_id = parent_id
+        self.attributes = dict(attributes or {})
+        self.status = 'ok'
+        self.start_time = time.time()
+        self._start_perf = time.perf_counter()
+        self._token = None
+        self._ended = False
+
+    @property
+    def traceparent(self) -> str:
+        return format_traceparent(self.trace_id, self.span_id)
+
+    def set_attribute(self, key: str, value) -> None:
+        self.attributes[key] = value
+
+    def activate(self) -> 'Span':
+        self._token = _current_span.set(self)
+        return self
+
+    def end(self, error: Optional[BaseException] = None) -> None:
+        if self._ended:
+            return
+        self._ended = True
+        duration_ms = (time.perf_counter() - self._start_perf) * 1000
+        if error is not None:
+            self.status = 'error'
+            self.attributes.setdefault('error', f'{type(error).__name__}: {error}')
+        if self._token is not None:
+            try:
+                _current_span.reset(self._token)
+            except ValueError:
+                # Ended from a different context than it was activated in
+                _current_span.set(None)
+            self._token = None
+        _exporter.export({
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'service': _service_name,
+            'start': self.start_time,
+            'duration_ms': round(duration_ms, 3),
+            'status': self.status,
+            'attributes': self.attributes,
+        })
+
+    def __enter__(self) -> 'Span':
+        return self.activate()
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        self.end(exc)
+        return False
+
+
+class _NoopSpan(Span):
+    def __init__(self, name: str = '', *args, **kwargs):
+        self.name = name
+        self.trace_id = ''
+        self.span_id = ''
+        self.parent_id = None
+        self.attributes = {}
+
+    @property
+    def traceparent(self) -> str:
+        return ''
+
+    def set_attribute(self, key: str, value) -> None:
+        pass
+
+    def activate(self) -> 'Span':
+        return self
+
+    def end(self, error: Optional[BaseException] = None) -> None:
+        pass
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def start_span(name: str, traceparent: Optional[str] = None, **attributes) -> Span:
+    """
+    Create a span under the current span (or the given traceparent)
+
+    Args:
+        name (str): Span name, e.g. 'superset.guest_token'
+        traceparent (str): Incoming header to continue; ignored when a
+            span is already active
+        **attributes: Initial span attributes
+
+    Returns:
+        Span: Not yet active - use it as a context manager
+    """
+    if not TRACING_ENABLED:
+        return _NoopSpan(name)
+
+    parent = current_span()
+    if parent is not None and parent.trace_id:
+        return Span(name, parent.trace_id, parent.span_id, attributes)
+
+    parsed = parse_traceparent(traceparent)
+    if parsed:
+        return Span(name, parsed[0], parsed[1], attributes)
+    return Span(name, new_trace_id(), None, attributes)
+
+
+def outbound_headers(headers: Optional[Dict] = None) -> Dict:
+    """
+    Return a copy of ``headers`` with the current traceparent added
+
+    Wrap every outbound HTTP call to Superset with this so its request
+    spans join the caller's trace.
+    """
+    result = dict(headers or {})
+    span = current_span()
+    if span is not None and span.trace_id:
+        result[TRACEPARENT_HEADER] = span.traceparent
+    return result
+
+
+# -------------------------------------------------------------------
+# SQL annotation
+# -------------------------------------------------------------------
+def annotate_sql(sql: str) -> str:
+    """
+    Append the current traceparent to a SQL statement as a comment
+
+    Uses the sqlcommenter format, appended at the end so it survives
+    statement splitting and keeps the leading keyword intact.
+    """
+    span = current_span()
+    if span is None or not span.trace_id or _SQL_COMMENT_RE.search(sql):
+        return sql
+    return f"{sql.rstrip().rstrip(';')}\n/*traceparent='{span.traceparent}'*/"
+
+
+def traceparent_from_sql(sql: str) -> Optional[str]:
+    match = _SQL_COMMENT_RE.search(sql or '')
+    return match.group(1) if match else None
+
+
+@functools.lru_cache(maxsize=None)
+def psycopg2_cursor_factory():
+    """
+    Build a psycopg2 cursor class that records a span per execute()
+
+    Superset runs chart and SQL Lab queries on raw DBAPI cursors, so
+    SQLAlchemy cursor events never fire for them. Passing this class as the
+    ``cursor_factory`` connect arg (see DB_CONNECTION_MUTATOR in
+    superset_config.py) times the statement on the database itself.
+    """
+    from psycopg2.extensions import cursor as base_cursor
+
+    class TracingCursor(base_cursor):
+        def execute(self, query, vars=None):
+            statement = query.decode('utf-8', 'replace') if isinstance(query, bytes) else str(query)
+            if current_span() is None and not traceparent_from_sql(statement):
+                return super().execute(query, vars)
+            with start_span(
+                'db.query',
+                traceparent=traceparent_from_sql(statement),
+                **{
+                    'db.system': 'postgresql',
+                    'db.name': self.connection.info.dbname,
+                    'db.host': self.connection.info.host,
+                    'db.statement': statement[:2000],
+                },
+            ) as span:
+                result = super().execute(query, vars)
+                span.set_attribute('db.rowcount', self.rowcount)
+                return result
+
+    return TracingCursor
+
+
+# -------------------------------------------------------------------
+# Flask integration
+# -------------------------------------------------------------------
+def init_flask_app(app, service_name: Optional[str] = None) -> None:
+    """
+    Open a span for every request handled by a Flask app
+
+    Static assets and health checks are skipped. The span continues an
+    incoming ``traceparent`` when present, records the guest token
+    fingerprint for embedded requests, and echoes the trace id back in the
+    ``X-Trace-Id`` response header.
+    """
+    from flask import g, request
+
+    if service_name:
+        configure(service_name=service_name)
+    if not TRACING_ENABLED:
+        return
+
+    @app.before_request
+    def _quest_start_request_span():
+        if request.path.startswith(UNTRACED_PATH_PREFIXES):
+            return
+        span = start_span(
+            f'{request.method} {request.url_rule.rule if request.url_rule else request.path}',
+            traceparent=request.headers.get(TRACEPARENT_HEADER),
+            **{
+                'http.method': request.method,
+                'http.target': request.full_path.rstrip('?'),
+            },
+        )
+        fingerprint = guest_token_fingerprint(request.headers.get(GUEST_TOKEN_HEADER))
+        if fingerprint:
+            span.set_attribute('guest_token_fp', fingerprint)
+        g.quest_trace_span = span.activate()
+
+    @app.after_request
+    def _quest_tag_response(response):
+        span = g.get('quest_trace_span')
+        if span is not None:
+            span.set_attribute('http.status_code', response.status_code)
+            if response.status_code >= 500:
+                span.status = 'error'
+            response.headers[TRACE_ID_RESPONSE_HEADER] = span.trace_id
+        return response
+
+    @app.teardown_request
+    def _quest_end_request_span(error=None):
+        span = g.pop('quest_trace_span', None)
+        if span is not None:
+            span.end(error)
@@ -0,0 +1,160 @@
+"""
+Quest Canada - Trace Waterfall Viewer
+
+Offline renderer for the span files written by quest_superset.tracing.
+Reads one or more JSON-lines files (backend + Superset), stitches embedded
+dashboard requests onto the backend request that issued their guest token,
+and prints a per-request waterfall.
+
+Usage:
+    python -m quest_superset.waterfall traces.jsonl superset_traces.jsonl
+    python -m quest_superset.waterfall traces.jsonl --trace 4bf92f3577b34da6a3ce929d0e0e4736
+    python -m quest_superset.waterfall traces.jsonl --slowest 5 --width 80
+"""
+
+import argparse
+import json
+import sys
+from collections import defaultdict
+from typing import Dict, Iterable, List
+
+
+def load_spans(paths: Iterable[str]) -> List[Dict]:
+    """Read spans from JSON-lines files, skipping malformed lines"""
+    spans = []
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            for line_no, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    spans.append(json.loads(line))
+                except json.JSONDecodeError:
+                    print(f'{path}:{line_no}: skipping malformed span', file=sys.stderr)
+    return spans
+
+
+def group_traces(spans: List[Dict]) -> Dict[str, List[Dict]]:
+    """
+    Group spans by trace id, merging guest-token-linked traces
+
+    A Superset request made with a guest token starts its own trace. If a
+    backend span recorded the same ``guest_token_fp``, that Superset trace
+    is re-parented under the backend span.
+    """
+    traces = defaultdict(list)
+    for span in spans:
+        traces[span['trace_id']].append(span)
+
+    issuers = {}
+    for trace_id, trace_spans in traces.items():
+        for span in trace_spans:
+            fp = span.get('attributes', {}).get('guest_token_fp')
+            if fp and span.get('attributes', {}).get('guest_token.issued'):
+                issuers[fp] = span
+
+    for trace_id in list(traces):
+        trace_spans = traces[trace_id]
+        root_ids = {s['span_id'] for s in trace_spans}
+        roots = [s for s in trace_spans if s.get('parent_id') not in root_ids]
+        fp = next((r.get('attributes', {}).get('guest_token_fp') for r in roots
+                   if r.get('attributes', {}).get('guest_token_fp')), None)
+        issuer = issuers.get(fp) if fp else None
+        if issuer is None or issuer['trace_id'] == trace_id:
+            continue
+        for root in roots:
+            root['parent_id'] = issuer['span_id']
+        for span in trace_spans:
+            span['trace_id'] = issuer['trace_id']
+        traces[issuer['trace_id']].extend(traces.pop(trace_id))
+
+    return dict(traces)
+
+
+def _ordered(trace_spans: List[Dict]) -> List[tuple]:
+    """Depth-first (span, depth) pairs, children sorted by start time"""
+    children = defaultdict(list)
+    ids = {s['span_id'] for s in trace_spans}
+    roots = []
+    for span in trace_spans:
+        if span.get('parent_id') in ids:
+            children[span['parent_id']].append(span)
+        else:
+            roots.append(span)
+
+    result = []
+
+    def visit(span, depth):
+        result.append((span, depth))
+        for child in sorted(children[span['span_id']], key=lambda s: s['start']):
+            visit(child, depth + 1)
+
+    for root in sorted(roots, key=lambda s: s['start']):
+        visit(root, 0)
+    return result
+
+
+def trace_bounds(trace_spans: List[Dict]) -> tuple:
+    start = min(s['start'] for s in trace_spans)
+    end = max(s['start'] + s['duration_ms'] / 1000 for s in trace_spans)
+    return start, end
+
+
+def render_trace(trace_id: str, trace_spans: List[Dict], width: int = 60) -> str:
+    """
+    Render one trace as a text waterfall
+
+    Each row shows offset from the trace start, a bar positioned on a
+    shared time axis, duration, service and span name.
+    """
+    start, end = trace_bounds(trace_spans)
+    total_ms = max((end - start) * 1000, 0.001)
+    lines = [f'trace {trace_id}  {total_ms:.1f} ms  {len(trace_spans)} spans']
+
+    for span, depth in _ordered(trace_spans):
+        offset_ms = (span['start'] - start) * 1000
+        left = int(offset_ms / total_ms * width)
+        length = max(1, int(round(span['duration_ms'] / total_ms * width)))
+        left = min(left, width - 1)
+        length = min(length, width - left)
+        bar = ' ' * left + '#' * length + ' ' * (width - left - length)
+        marker = '!' if span.get('status') == 'error' else ' '
+        label = '  ' * depth + span['name']
+        lines.append(
+            f"{offset_ms:9.1f} ms |{bar}| {span['duration_ms']:9.1f} ms{marker} "
+            f"{span.get('service', '?'):<10} {label}"
+        )
+        statement = span.get('attributes', {}).get('db.statement')
+        if statement:
+            lines.append(' ' * (width + 38) + '  ' * depth + '  ' + ' '.join(statement.split())[:100])
+    return '\n'.join(lines)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Render request waterfalls from span files')
+    parser.add_argument('files', nargs='+', help='JSON-lines span files')
+    parser.add_argument('--trace', help='Only render this trace id')
+    parser.add_argument('--slowest', type=int, default=10,
+                        help='Render the N slowest traces (default: 10)')
+    parser.add_argument('--width', type=int, default=60, help='Bar width in characters')
+    args = parser.parse_args(argv)
+
+    traces = group_traces(load_spans(args.files))
+    if args.trace:
+        if args.trace not in traces:
+            print(f'Trace {args.trace} not found', file=sys.stderr)
+            return 1
+        selected = [args.trace]
+    else:
+        def duration(trace_id):
+            start, end = trace_bounds(traces[trace_id])
+            return end - start
+        selected = sorted(traces, key=duration, reverse=True)[:args.slowest]
+
+    print('\n\n'.join(render_trace(t, traces[t], args.width) for t in selected))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
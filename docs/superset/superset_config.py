@@ -5,10 +5,16 @@ Enables embedding, guest tokens, CORS, and Row-Level Security (RLS)
 IMPORTANT: Change all secrets in production!
 """
 
+import logging
 import os
 from typing import Optional
 from flask import g
 
+from quest_superset import cache as single_flight
+from quest_superset import replicas, rollups, tracing
+
+query_logger = logging.getLogger('quest.query')
+
 # -------------------------------------------------------------------
 # Flask App Builder Configuration
 # -------------------------------------------------------------------
@@ -153,7 +159,25 @@ CACHE_CONFIG = {
 }
 
 # Data cache (query results)
-DATA_CACHE_CONFIG = CACHE_CONFIG
+# Identical concurrent chart queries are coalesced: the first request runs the
+# query while the others wait for its result (see quest_superset/cache.py).
+# Check how many executions were saved: python -m quest_superset.cache stats
+#
+# Entries are also indexed by the tables and community they read, so the
+# invalidation listener (python -m quest_superset.invalidation listen) can
+# evict exactly what an import changed. With the listener running, raise
+# DATA_CACHE_TIMEOUT to hours (e.g. 21600); results that read no watched
+# table still expire after CACHE_UNINDEXED_TIMEOUT.
+DATA_CACHE_CONFIG = {
+    **CACHE_CONFIG,
+    'CACHE_TYPE': 'quest_superset.cache.SingleFlightRedisCache',
+    'CACHE_DEFAULT_TIMEOUT': int(os.getenv('DATA_CACHE_TIMEOUT', 300)),
+    # Followers wait while the leader's lock exists, so it must outlive the
+    # slowest query: keep >= SUPERSET_WEBSERVER_TIMEOUT and SQLLAB_TIMEOUT below
+    'SINGLE_FLIGHT_LOCK_TIMEOUT': 300,
+    'CACHE_DEPENDENCY_INDEX': True,
+    'CACHE_UNINDEXED_TIMEOUT': 300,
+}
 
 # Thumbnail cache
 THUMBNAIL_CACHE_CONFIG = {
@@ -178,7 +202,7 @@ FILTER_STATE_CACHE_CONFIG = {
 # -------------------------------------------------------------------
 # Web Server Configuration
 # -------------------------------------------------------------------
-# Increase timeout for large queries
+# Increase timeout for large queries (raise SINGLE_FLIGHT_LOCK_TIMEOUT with it)
 SUPERSET_WEBSERVER_TIMEOUT = 300
 
 # Allow bigger file uploads
@@ -200,7 +224,7 @@ PREVENT_UNSAFE_DB_CONNECTIONS = False
 QUERY_RESULT_LIMIT = 10000
 SQL_MAX_ROW = 100000
 
-# SQL Lab timeout
+# SQL Lab timeout (raise SINGLE_FLIGHT_LOCK_TIMEOUT with it)
 SQLLAB_TIMEOUT = 300
 
 # CSV export encoding
@@ -208,6 +232,47 @@ CSV_EXPORT = {
     'encoding': 'utf-8',
 }
 
+# -------------------------------------------------------------------
+# Read Replica Routing
+# -------------------------------------------------------------------
+# Chart and embedded dashboard reads against the Quest Canada database go
+# to a healthy replica; everything else (and all reads when replicas lag)
+# uses the primary. READ_REPLICA_ROUTE_SQL_LAB=true also routes SQL Lab,
+# which needs "Allow DML" and "Allow CREATE TABLE AS" off for the database.
+# Leave READ_REPLICA_URIS empty to disable. Example:
+#   READ_REPLICA_PRIMARY_URI=postgresql://db-primary:5432/quest_canada
+#   READ_REPLICA_URIS=postgresql://db-replica-1:5432/quest_canada,postgresql://db-replica-2:5432/quest_canada
+READ_REPLICA_ROUTER = replicas.router_from_env()
+
+
+def DB_CONNECTION_MUTATOR(uri, params, username, security_manager, source):
+    """Route reads to replicas and time statements via a tracing cursor"""
+    uri, routed = READ_REPLICA_ROUTER.route(uri, source, security_manager)
+    if routed:
+        params = replicas.mark_read_only(params)
+        span = tracing.current_span()
+        if span is not None:
+            span.set_attribute('db.replica', f'{uri.host}:{uri.port or 5432}')
+
+    # The cursor class is psycopg2-specific and only worth its overhead when
+    # spans are recorded
+    if tracing.TRACING_ENABLED and uri.get_driver_name() == 'psycopg2':
+        connect_args = params.setdefault('connect_args', {})
+        connect_args.setdefault('cursor_factory', tracing.psycopg2_cursor_factory())
+    return uri, params
+
+
+# -------------------------------------------------------------------
+# Emissions Rollups
+# -------------------------------------------------------------------
+# Monthly/yearly emissions charts are answered from pre-aggregated rollup
+# tables when the result is provably identical (see quest_superset/rollups.py).
+# Enable only after creating and refreshing the rollups:
+#   ROLLUP_DATABASE_URI=... python -m quest_superset.rollups create
+#   ROLLUP_DATABASE_URI=... python -m quest_superset.rollups refresh
+ROLLUP_ROUTING_ENABLED = os.getenv('ROLLUP_ROUTING_ENABLED', 'false').lower() == 'true'
+
+
 # -------------------------------------------------------------------
 # Email Configuration (Optional - for alerts)
 # -------------------------------------------------------------------
@@ -268,6 +333,47 @@ LOG_FORMAT = "%(asctime)s:%(levelname)s:%(name)s:%(message)s"
 # Log file location (comment out to disable file logging)
 # FILENAME = os.path.join(os.path.expanduser("~"), "superset.log")
 
+# -------------------------------------------------------------------
+# Request Tracing
+# -------------------------------------------------------------------
+# Continues the backend's traceparent header, tags SQL with it and writes
+# spans to a local JSON-lines file (rotated at TRACE_EXPORT_MAX_BYTES).
+# Off unless TRACING_ENABLED=true. Render with:
+#   python -m quest_superset.waterfall backend_traces.jsonl superset_traces.jsonl
+tracing.configure(
+    service_name='superset',
+    export_path=os.getenv('TRACE_EXPORT_PATH', '/app/superset_home/traces.jsonl'),
+)
+
+
+def FLASK_APP_MUTATOR(app):
+    """Open a span for every Superset request and free single-flight locks after it"""
+    tracing.init_flask_app(app)
+
+    @app.teardown_request
+    def _release_single_flight_locks(error=None):
+        single_flight.release_held_locks()
+
+
+def QUERY_LOGGER(database, query, schema=None, client=None, security_manager=None, log_params=None):
+    """Log every analytics query with the trace id of the request that ran it"""
+    span = tracing.current_span()
+    query_logger.info(
+        'trace_id=%s database=%s schema=%s sql=%s',
+        span.trace_id if span else '-',
+        getattr(database, 'database_name', database),
+        schema,
+        ' '.join(str(query).split())[:500],
+    )
+
+
+def SQL_QUERY_MUTATOR(sql, **kwargs):
+    """Answer emissions aggregates from rollups, then append the traceparent comment"""
+    if ROLLUP_ROUTING_ENABLED:
+        sql = rollups.rewrite_for_rollup(sql)
+    return tracing.annotate_sql(sql)
+
+
 # -------------------------------------------------------------------
 # Async Query Configuration (Optional - for long-running queries)
 # -------------------------------------------------------------------
@@ -0,0 +1,26 @@
+import os
+import sys
+
+import pytest
+
+# Import quest_superset the way Superset does (from PYTHONPATH)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def pg_conn():
+    """Connection to QUEST_TEST_DATABASE_URI; skips the test when unset"""
+    uri = os.getenv('QUEST_TEST_DATABASE_URI')
+    if not uri:
+        pytest.skip('QUEST_TEST_DATABASE_URI not set')
+    psycopg2 = pytest.importorskip('psycopg2')
+
+    try:
+        conn = psycopg2.connect(uri, connect_timeout=2)
+    except psycopg2.OperationalError as e:
+        pytest.skip(f'Postgres unavailable: {e}')
+    try:
+        yield conn
+    finally:
+        conn.rollback()
+        conn.close()
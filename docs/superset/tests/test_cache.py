@@ -0,0 +1,194 @@
+import threading
+import time
+
+import pytest
+
+pytest.importorskip('flask_caching')
+pytest.importorskip('redis')
+
+from quest_superset import cache as single_flight  # noqa: E402
+
+KEY = 'chart-1'
+
+
+class StubRedis:
+    """The subset of redis.Redis the single-flight cache uses, with expiry"""
+
+    def __init__(self):
+        self.values = {}
+        self.expires = {}
+        self.hashes = {}
+        self._lock = threading.Lock()
+
+    def _alive(self, name):
+        deadline = self.expires.get(name)
+        if deadline is not None and time.monotonic() >= deadline:
+            self.values.pop(name, None)
+            self.expires.pop(name, None)
+        return name in self.values
+
+    def get(self, name):
+        with self._lock:
+            return self.values.get(name) if self._alive(name) else None
+
+    def set(self, name, value, ex=None, px=None, nx=False):
+        with self._lock:
+            if nx and self._alive(name):
+                return None
+            self.values[name] = value if isinstance(value, bytes) else str(value).encode()
+            self.expires.pop(name, None)
+            if ex is not None:
+                self.expires[name] = time.monotonic() + ex
+            if px is not None:
+                self.expires[name] = time.monotonic() + px / 1000
+            return True
+
+    def exists(self, *names):
+        with self._lock:
+            return sum(1 for name in names if self._alive(name))
+
+    def delete(self, *names):
+        with self._lock:
+            return sum(1 for name in names if self.values.pop(name, None) is not None)
+
+    def eval(self, script, numkeys, key, token):
+        # Only the compare-and-delete release script is used
+        with self._lock:
+            if self._alive(key) and self.values[key] == token.encode():
+                del self.values[key]
+                return 1
+            return 0
+
+    def hincrby(self, name, field, amount=1):
+        with self._lock:
+            fields = self.hashes.setdefault(name, {})
+            fields[field.encode()] = fields.get(field.encode(), 0) + amount
+            return fields[field.encode()]
+
+    def hgetall(self, name):
+        with self._lock:
+            return {k: str(v).encode() for k, v in self.hashes.get(name, {}).items()}
+
+
+@pytest.fixture
+def cache():
+    c = single_flight.SingleFlightRedisCache(key_prefix='test_')
+    c._write_client = c._read_client = StubRedis()
+    c.lock_timeout = 2.0
+    c.poll_interval = 0.01
+    yield c
+    single_flight.release_held_locks()
+
+
+def lock_exists(cache):
+    return bool(cache._write_client.exists(cache._lock_key(KEY)))
+
+
+def in_thread(fn):
+    """Run fn in another thread (its own held locks); returns a join() -> result"""
+    result = {}
+    thread = threading.Thread(target=lambda: result.setdefault('value', fn()))
+    thread.start()
+
+    def join(timeout=5):
+        thread.join(timeout)
+        assert not thread.is_alive()
+        return result['value']
+    return join
+
+
+def test_leader_miss_takes_lock(cache):
+    assert cache.get(KEY) is None
+    assert lock_exists(cache)
+    assert cache.stats() == {'leader': 1}
+
+
+def test_repeated_get_by_leader_does_not_wait(cache):
+    cache.get(KEY)
+    started = time.monotonic()
+    assert cache.get(KEY) is None
+    assert time.monotonic() - started < 0.5
+
+
+def test_follower_reads_leaders_value(cache):
+    assert cache.get(KEY) is None
+    follower = in_thread(lambda: cache.get(KEY))
+    time.sleep(0.1)
+    cache.set(KEY, {'data': [1, 2]})
+
+    assert follower() == {'data': [1, 2]}
+    assert not lock_exists(cache)
+    assert cache.stats() == {'leader': 1, 'coalesced': 1}
+
+
+def test_follower_waits_while_lock_exists(cache):
+    cache.lock_timeout = 5.0
+    cache.get(KEY)
+    follower = in_thread(lambda: cache.get(KEY))
+    # Longer than any fixed short wait; the follower must still be waiting
+    time.sleep(0.5)
+    cache.set(KEY, 'slow result')
+    assert follower() == 'slow result'
+
+
+def test_takeover_after_leader_releases_without_writing(cache):
+    cache.get(KEY)
+    follower = in_thread(lambda: (cache.get(KEY), lock_exists(cache)))
+    time.sleep(0.1)
+    single_flight.release_held_locks()
+
+    assert follower() == (None, True)
+    assert cache.stats() == {'leader': 1, 'takeover': 1}
+
+
+def test_takeover_after_lock_expires(cache):
+    cache.lock_timeout = 0.2
+    cache.get(KEY)
+    assert in_thread(lambda: cache.get(KEY))() is None
+    assert cache.stats() == {'leader': 1, 'takeover': 1}
+
+
+def test_release_held_locks_frees_lock(cache):
+    cache.get(KEY)
+    single_flight.release_held_locks()
+    assert not lock_exists(cache)
+    assert single_flight._held_locks() == {}
+
+
+def test_delete_releases_lock(cache):
+    cache.get(KEY)
+    cache.delete(KEY)
+    assert not lock_exists(cache)
+
+
+def test_release_never_frees_another_owners_lock(cache):
+    cache.lock_timeout = 0.1
+    cache.get(KEY)
+    time.sleep(0.15)
+    # The lock expired and another request became leader
+    in_thread(lambda: cache.get(KEY))()
+    single_flight.release_held_locks()
+    assert lock_exists(cache)
+
+
+def test_wait_timeout(cache):
+    cache.wait_timeout = 0.2
+    cache.get(KEY)
+    assert in_thread(lambda: cache.get(KEY))() is None
+    # The leader still owns the key
+    assert lock_exists(cache)
+    assert cache.stats() == {'leader': 1, 'wait_timeout': 1}
+
+
+def test_hit_records_nothing(cache):
+    cache.set(KEY, 'cached')
+    assert cache.get(KEY) == 'cached'
+    assert cache.stats() == {}
+
+
+def test_wait_timeout_defaults_to_lock_timeout():
+    c = single_flight.SingleFlightRedisCache.factory(
+        None, {'SINGLE_FLIGHT_LOCK_TIMEOUT': 120, 'CACHE_KEY_PREFIX': 'x_'}, [], {},
+    )
+    assert c.lock_timeout == 120
+    assert c.wait_timeout is None
@@ -0,0 +1,122 @@
+import fnmatch
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('sqlglot')
+
+from quest_superset import invalidation  # noqa: E402
+
+
+def deps(sql):
+    return invalidation.cache_dependencies({'query': sql})
+
+
+def test_single_table_scope():
+    assert deps("SELECT * FROM assessments WHERE community_id = 'c5'") == {
+        'assessments': ('id', ('c5',)),
+    }
+
+
+def test_join_only_scopes_table_owning_the_column():
+    sql = ("SELECT * FROM assessments a JOIN projects p ON p.community_id = a.community_id "
+           "WHERE a.community_id = '5'")
+    assert deps(sql) == {'assessments': ('id', ('5',)), 'projects': None}
+
+
+def test_unqualified_column_in_join_is_not_a_scope():
+    sql = "SELECT * FROM assessments JOIN strengths ON strengths.assessment_id = assessments.id WHERE community_id = '5'"
+    assert deps(sql) == {'assessments': None, 'strengths': None}
+
+
+def test_self_join_is_not_scoped():
+    sql = "SELECT * FROM assessments a JOIN assessments b ON a.id = b.id WHERE a.community_id = '5'"
+    assert deps(sql) == {'assessments': None}
+
+
+def test_rls_name_subquery_scopes_rollup_source():
+    sql = ("SELECT sector FROM energy_emissions_rollup_daily AS energy_emissions_data "
+           "WHERE energy_emissions_data.community_id IN "
+           "(SELECT id FROM communities WHERE name = 'Calgary')")
+    assert deps(sql) == {
+        'energy_emissions_data': ('name', ('Calgary',)),
+        'communities': None,
+    }
+
+
+def test_other_subquery_disables_scoping():
+    sql = "SELECT * FROM assessments WHERE community_id = '5' AND id IN (SELECT assessment_id FROM strengths)"
+    assert deps(sql) == {'assessments': None, 'strengths': None}
+
+
+def test_or_is_not_a_scope():
+    sql = "SELECT * FROM assessments WHERE community_id = '5' OR community_id = '6'"
+    assert deps(sql) == {'assessments': None}
+
+
+def test_views_map_to_source_tables():
+    assert deps('SELECT * FROM latest_benchmark_assessments WHERE community_id = 3') == {
+        'communities': None,
+        'benchmark_assessments': None,
+    }
+
+
+def test_current_schema_emissions_views_map_to_source():
+    assert deps('SELECT * FROM energy_emissions_monthly WHERE community_id = 3') == {
+        'energy_emissions_data': ('id', ('3',)),
+    }
+    assert deps('SELECT * FROM emissions_progress') == {
+        'communities': None,
+        'energy_emissions_data': None,
+    }
+
+
+def test_truncate_notifies_without_community():
+    statements = invalidation.trigger_sql('assessments', 'community_id')
+    assert "IF TG_OP = 'TRUNCATE' THEN\n        PERFORM quest_notify_change(TG_TABLE_NAME, NULL)" in statements[0]
+    assert any('AFTER TRUNCATE ON assessments\nFOR EACH STATEMENT' in s for s in statements)
+
+
+def test_unwatched_table_has_no_dependencies():
+    assert deps('SELECT * FROM some_other_table') == {}
+
+
+class StubRedis:
+    """Keys and sets, with SCAN/SSCAN and the prune script"""
+
+    def __init__(self, values=(), sets=None):
+        self.values = set(values)
+        self.sets = sets or {}
+
+    def scan_iter(self, match, count=None):
+        return iter([k for k in self.sets if fnmatch.fnmatchcase(k, match)])
+
+    def sscan_iter(self, name, count=None):
+        return iter(list(self.sets.get(name, ())))
+
+    def eval(self, script, numkeys, set_key, prefix, *members):
+        assert script == invalidation.PRUNE_SCRIPT
+        dead = {m for m in members if prefix + m not in self.values} & self.sets[set_key]
+        self.sets[set_key] -= dead
+        return len(dead)
+
+
+def test_prune_index_removes_expired_members():
+    pytest.importorskip('sqlalchemy')
+    redis = StubRedis(
+        values={'test_live'},
+        sets={
+            'test_deps:assessments:all': {'live', 'expired'},
+            'test_deps:projects:id:5': {'expired'},
+            'other_deps:assessments:all': {'expired'},
+        },
+    )
+    cache = SimpleNamespace(_write_client=redis, _get_prefix=lambda: 'test_')
+    invalidator = invalidation.CacheInvalidator(cache, 'postgresql://localhost/quest_canada')
+
+    assert invalidator.prune_index() == 2
+    assert redis.sets == {
+        'test_deps:assessments:all': {'live'},
+        'test_deps:projects:id:5': set(),
+        'other_deps:assessments:all': {'expired'},
+    }
@@ -0,0 +1,105 @@
+from datetime import date, timedelta
+
+import pytest
+
+from quest_superset import rls
+
+THURSDAY = date(2026, 10, 22)
+
+
+def test_day_window_starts_days_back():
+    assert rls.time_window_start(90, 'day', THURSDAY) == date(2026, 7, 24)
+
+
+def test_week_window_starts_on_monday():
+    start = rls.time_window_start(90, 'week', THURSDAY)
+    assert start == date(2026, 7, 20)
+    assert start.weekday() == 0
+
+
+def test_week_window_is_stable_within_a_week():
+    starts = {rls.time_window_start(90, 'week', THURSDAY + timedelta(days=n)) for n in range(-4, 3)}
+    assert starts == {date(2026, 7, 20)}
+
+
+def test_day_window_changes_daily():
+    assert rls.time_window_start(90, 'day', THURSDAY + timedelta(days=1)) == date(2026, 7, 25)
+
+
+def test_unknown_bucket_rejected():
+    with pytest.raises(ValueError):
+        rls.time_window_start(90, 'month', THURSDAY)
+
+
+def test_clause_with_community_id():
+    clause = rls.time_window_clause({'community_id': 3}, 90, 'week', today=THURSDAY)
+    assert clause == (
+        'energy_emissions_data.community_id = 3 AND '
+        'energy_emissions_data."time" >= TIMESTAMPTZ \'2026-07-20 00:00:00+00\''
+    )
+
+
+def test_clause_with_community_name_is_escaped():
+    clause = rls.time_window_clause({'community': "St. John's"}, 30, today=THURSDAY)
+    assert clause == (
+        "energy_emissions_data.community_id IN "
+        "(SELECT id FROM communities WHERE name = 'St. John''s') AND "
+        "energy_emissions_data.\"time\" >= TIMESTAMPTZ '2026-09-22 00:00:00+00'"
+    )
+
+
+def test_clause_for_admin_has_only_time_filter():
+    clause = rls.time_window_clause({'role': 'admin'}, 90, today=THURSDAY)
+    assert clause == 'energy_emissions_data."time" >= TIMESTAMPTZ \'2026-07-24 00:00:00+00\''
+
+
+def test_clause_without_community_is_none():
+    assert rls.time_window_clause({'role': 'user'}, 90, today=THURSDAY) is None
+
+
+def test_clause_custom_table_and_column():
+    clause = rls.time_window_clause({'community_id': 1}, 7, table='readings', time_column='ts',
+                                    today=THURSDAY)
+    assert clause.startswith('readings.community_id = 1 AND readings."ts" >= ')
+
+
+@pytest.mark.parametrize('table,column', [('energy; DROP TABLE x', 'time'), ('t', 'time"--')])
+def test_invalid_identifiers_rejected(table, column):
+    with pytest.raises(ValueError):
+        rls.time_window_clause({'community_id': 1}, table=table, time_column=column)
+
+
+def test_planner_uses_community_time_index(pg_conn):
+    """The generated clause is answered from the (community_id, time) index"""
+    clause = rls.time_window_clause({'community_id': 3}, 90, 'week', today=THURSDAY)
+
+    with pg_conn.cursor() as cur:
+        # Temporary table shadows the real one for this session only
+        cur.execute("""
+            CREATE TEMP TABLE energy_emissions_data (
+                time TIMESTAMPTZ NOT NULL,
+                community_id INTEGER NOT NULL,
+                sector TEXT,
+                emissions_tco2e DOUBLE PRECISION
+            )
+        """)
+        cur.execute("""
+            INSERT INTO energy_emissions_data
+            SELECT TIMESTAMPTZ '2024-01-01' + n * INTERVAL '1 hour', n % 50, 'residential', 1
+            FROM generate_series(1, 50000) AS n
+        """)
+        cur.execute("""
+            CREATE INDEX idx_energy_emissions_community
+            ON energy_emissions_data (community_id, time DESC)
+        """)
+        cur.execute('ANALYZE energy_emissions_data')
+        cur.execute(
+            'EXPLAIN SELECT sector, SUM(emissions_tco2e) FROM energy_emissions_data '
+            f'WHERE ({clause}) GROUP BY sector'
+        )
+        plan = '\n'.join(row[0] for row in cur.fetchall())
+
+    assert 'idx_energy_emissions_community' in plan, plan
+    index_cond = next(line for line in plan.splitlines() if 'Index Cond' in line)
+    assert 'community_id = 3' in index_cond, plan
+    assert '"time" >=' in index_cond, plan
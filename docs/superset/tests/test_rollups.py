@@ -0,0 +1,203 @@
+import os
+from decimal import Decimal
+
+import pytest
+
+pytest.importorskip('sqlglot')
+
+from quest_superset import rollups  # noqa: E402
+from quest_superset.rollups import rewrite_for_rollup  # noqa: E402
+
+MONTHLY = (
+    "SELECT DATE_TRUNC('month', time) AS month, sector, SUM(emissions_tco2e) AS emissions "
+    "FROM energy_emissions_data "
+    "WHERE time >= '2024-01-01' AND time < '2025-01-01' "
+    "GROUP BY 1, 2"
+)
+
+
+def test_monthly_sum_uses_monthly_rollup():
+    sql = rewrite_for_rollup(MONTHLY)
+    assert 'FROM energy_emissions_rollup_monthly AS energy_emissions_data' in sql
+    assert 'SUM(emissions_tco2e)' in sql
+
+
+def test_yearly_boundaries_use_yearly_rollup():
+    sql = rewrite_for_rollup(
+        "SELECT DATE_TRUNC('year', time), SUM(consumption_gj) FROM energy_emissions_data "
+        "WHERE time >= '2020-01-01' GROUP BY 1"
+    )
+    assert 'energy_emissions_rollup_yearly' in sql
+
+
+def test_mid_month_boundary_falls_back_to_daily():
+    sql = rewrite_for_rollup(
+        "SELECT DATE_TRUNC('month', time), SUM(consumption_gj) FROM energy_emissions_data "
+        "WHERE time >= '2024-01-15' GROUP BY 1"
+    )
+    assert 'energy_emissions_rollup_daily' in sql
+
+
+def test_sub_day_boundary_not_rewritten():
+    sql = ("SELECT SUM(consumption_gj) FROM energy_emissions_data "
+           "WHERE time >= '2024-01-15 12:00:00'")
+    assert rewrite_for_rollup(sql) == sql
+
+
+def test_count_star_is_zero_on_empty_input():
+    sql = rewrite_for_rollup('SELECT COUNT(*) FROM energy_emissions_data WHERE community_id = 99')
+    assert 'COALESCE(CAST(SUM(row_count) AS BIGINT), 0)' in sql
+
+
+def test_count_of_nullable_measure_uses_its_own_count():
+    sql = rewrite_for_rollup('SELECT sector, COUNT(cost_cad) FROM energy_emissions_data GROUP BY sector')
+    assert 'COALESCE(CAST(SUM(cost_cad_count) AS BIGINT), 0)' in sql
+
+
+def test_avg_is_weighted_by_row_count():
+    sql = rewrite_for_rollup('SELECT sector, AVG(emissions_tco2e) FROM energy_emissions_data GROUP BY sector')
+    assert 'SUM(emissions_tco2e) / SUM(row_count)' in sql
+
+
+def test_rls_subquery_on_communities_is_rewritten():
+    sql = rewrite_for_rollup(
+        "SELECT sector, SUM(emissions_tco2e) FROM energy_emissions_data "
+        "WHERE energy_emissions_data.community_id IN "
+        "(SELECT id FROM communities WHERE name = 'Calgary') GROUP BY sector"
+    )
+    assert 'energy_emissions_rollup_yearly AS energy_emissions_data' in sql
+
+
+@pytest.mark.parametrize('sql', [
+    # Aggregates the rollups cannot answer exactly
+    'SELECT sector, MAX(emissions_tco2e) FROM energy_emissions_data GROUP BY sector',
+    'SELECT COUNT(DISTINCT sector) FROM energy_emissions_data',
+    'SELECT AVG(cost_cad) FROM energy_emissions_data',
+    # Columns the rollups drop
+    "SELECT sector, SUM(emissions_tco2e) FROM energy_emissions_data WHERE notes IS NULL GROUP BY sector",
+    # Row-level and multi-table queries
+    'SELECT * FROM energy_emissions_data',
+    'SELECT c.name, SUM(e.emissions_tco2e) FROM energy_emissions_data e '
+    'JOIN communities c ON c.id = e.community_id GROUP BY c.name',
+    # Time used outside DATE_TRUNC or a constant range filter
+    "SELECT DATE_TRUNC('hour', time), SUM(emissions_tco2e) FROM energy_emissions_data GROUP BY 1",
+    'SELECT SUM(emissions_tco2e) FROM energy_emissions_data WHERE time >= NOW() - INTERVAL \'7 days\'',
+    # Correlated subqueries reading the outer rows
+    'SELECT sector, SUM(emissions_tco2e) FROM energy_emissions_data e WHERE EXISTS '
+    '(SELECT 1 FROM communities c WHERE c.id = e.community_id AND e.notes IS NULL) GROUP BY sector',
+    'SELECT sector, SUM(emissions_tco2e) FROM energy_emissions_data WHERE EXISTS '
+    '(SELECT 1 FROM communities c WHERE c.name = energy_emissions_data.notes) GROUP BY sector',
+    'SELECT sector, SUM(emissions_tco2e) FROM energy_emissions_data WHERE EXISTS '
+    '(SELECT 1 FROM communities c WHERE c.name = notes) GROUP BY sector',
+])
+def test_not_rewritten(sql):
+    assert rewrite_for_rollup(sql) == sql
+
+
+EQUIVALENCE_QUERIES = [
+    MONTHLY + ' ORDER BY 1, 2',
+    'SELECT COUNT(*), COUNT(cost_cad) FROM energy_emissions_data WHERE community_id = 99',
+    "SELECT DATE_TRUNC('year', time), community_id, COUNT(*), COUNT(cost_cad), SUM(cost_cad), "
+    'AVG(emissions_tco2e) FROM energy_emissions_data GROUP BY 1, 2 ORDER BY 1, 2',
+    "SELECT DATE_TRUNC('week', time), SUM(consumption_gj) FROM energy_emissions_data "
+    "WHERE time >= '2024-02-05' AND time < '2024-03-04' GROUP BY 1 ORDER BY 1",
+]
+
+
+@pytest.fixture
+def rollup_schema(pg_conn):
+    """Source table and rollups in a scratch schema, dropped afterwards"""
+    schema = 'quest_rollup_test'
+    pg_conn.autocommit = True
+    with pg_conn.cursor() as cur:
+        cur.execute(f'DROP SCHEMA IF EXISTS {schema} CASCADE')
+        cur.execute(f'CREATE SCHEMA {schema}')
+        cur.execute(f'SET search_path = {schema}')
+        cur.execute("""
+            CREATE TABLE energy_emissions_data (
+                time TIMESTAMPTZ NOT NULL,
+                community_id INTEGER NOT NULL,
+                sector VARCHAR(50) NOT NULL,
+                energy_source VARCHAR(50) NOT NULL,
+                consumption_gj NUMERIC(12,2) NOT NULL,
+                emissions_tco2e NUMERIC(12,2) NOT NULL,
+                cost_cad NUMERIC(12,2),
+                notes TEXT,
+                created_at TIMESTAMPTZ DEFAULT now()
+            )
+        """)
+        cur.execute("""
+            INSERT INTO energy_emissions_data
+                (time, community_id, sector, energy_source, consumption_gj, emissions_tco2e, cost_cad)
+            SELECT TIMESTAMPTZ '2023-06-01 00:00:00+00' + n * INTERVAL '7 hours',
+                   n % 3, (ARRAY['residential', 'commercial'])[n % 2 + 1], 'electricity',
+                   (n % 17) * 1.25, (n % 11) * 0.5,
+                   CASE WHEN n % 4 = 0 THEN NULL ELSE n % 13 END
+            FROM generate_series(1, 5000) AS n
+        """)
+
+    uri = f"{os.environ['QUEST_TEST_DATABASE_URI']}?options=-csearch_path%3D{schema}"
+    maintainer = rollups.RollupMaintainer(uri)
+    maintainer.create()
+    maintainer.refresh()
+    try:
+        yield pg_conn, maintainer
+    finally:
+        maintainer.engine.dispose()
+        with pg_conn.cursor() as cur:
+            cur.execute(f'DROP SCHEMA {schema} CASCADE')
+
+
+def _normalise(rows):
+    return [tuple(round(v, 6) if isinstance(v, Decimal) else v for v in row) for row in rows]
+
+
+def assert_rollups_match_raw(conn, sql):
+    rewritten = rewrite_for_rollup(sql)
+    assert rewritten != sql
+    with conn.cursor() as cur:
+        cur.execute(sql)
+        raw = cur.fetchall()
+        cur.execute(rewritten)
+        assert _normalise(cur.fetchall()) == _normalise(raw)
+
+
+@pytest.mark.parametrize('sql', EQUIVALENCE_QUERIES)
+def test_rollup_results_match_raw(rollup_schema, sql):
+    conn, _ = rollup_schema
+    assert_rollups_match_raw(conn, sql)
+
+
+def test_refresh_picks_up_edits_deletes_and_backfills(rollup_schema):
+    conn, maintainer = rollup_schema
+    with conn.cursor() as cur:
+        cur.execute("UPDATE energy_emissions_data SET emissions_tco2e = emissions_tco2e + 1 "
+                    "WHERE time < '2023-08-01'")
+        # Moves rows into another month; both months must be recomputed
+        cur.execute("UPDATE energy_emissions_data SET time = time + INTERVAL '400 days' "
+                    "WHERE community_id = 1 AND time < '2023-07-01'")
+        cur.execute("DELETE FROM energy_emissions_data WHERE sector = 'commercial' "
+                    "AND time >= '2024-02-10' AND time < '2024-02-20'")
+        # Backfill of old data whose created_at says nothing about its time
+        cur.execute("""
+            INSERT INTO energy_emissions_data
+                (time, community_id, sector, energy_source, consumption_gj, emissions_tco2e, created_at)
+            VALUES ('2019-03-05 10:00+00', 99, 'residential', 'gas', 5, 2, NULL),
+                   ('2019-03-06 10:00+00', 99, 'residential', 'gas', 7, 3, '2019-03-06')
+        """)
+
+    start, end = maintainer.refresh()
+    assert start.year == 2019
+    for sql in EQUIVALENCE_QUERIES:
+        assert_rollups_match_raw(conn, sql)
+    assert maintainer.refresh() is None
+
+
+def test_truncate_triggers_full_rebuild(rollup_schema):
+    conn, maintainer = rollup_schema
+    with conn.cursor() as cur:
+        cur.execute('TRUNCATE energy_emissions_data')
+    assert maintainer.refresh() is None
+    with conn.cursor() as cur:
+        cur.execute('SELECT COUNT(*) FROM energy_emissions_rollup_yearly')
+        assert cur.fetchone() == (0,)
@@ -0,0 +1,83 @@
+import json
+
+import pytest
+
+from quest_superset import tracing, waterfall
+
+
+def test_traceparent_round_trip():
+    header = tracing.format_traceparent('a' * 32, 'b' * 16)
+    assert tracing.parse_traceparent(header) == ('a' * 32, 'b' * 16)
+    assert tracing.parse_traceparent('00-' + '0' * 32 + '-' + 'b' * 16 + '-01') is None
+    assert tracing.parse_traceparent('garbage') is None
+
+
+def test_annotate_sql_appends_current_traceparent(tmp_path, monkeypatch):
+    monkeypatch.setattr(tracing, 'TRACING_ENABLED', True)
+    monkeypatch.setattr(tracing, '_exporter', tracing.FileSpanExporter(str(tmp_path / 'traces.jsonl')))
+    with tracing.start_span('query') as span:
+        sql = tracing.annotate_sql('SELECT 1;  ')
+        assert sql == f"SELECT 1\n/*traceparent='{span.traceparent}'*/"
+        assert tracing.annotate_sql(sql) == sql
+    assert tracing.traceparent_from_sql(sql) == span.traceparent
+
+
+def test_annotate_sql_without_span_is_unchanged():
+    assert tracing.annotate_sql('SELECT 1') == 'SELECT 1'
+    assert tracing.traceparent_from_sql('SELECT 1') is None
+    assert tracing.traceparent_from_sql(None) is None
+
+
+def test_exporter_rotates_at_max_bytes(tmp_path):
+    path = tmp_path / 'traces.jsonl'
+    exporter = tracing.FileSpanExporter(str(path), max_bytes=200)
+    for n in range(10):
+        exporter.export({'n': n, 'pad': 'x' * 40})
+
+    rotated = tmp_path / 'traces.jsonl.1'
+    assert rotated.exists()
+    assert path.stat().st_size < 200 + 60
+    lines = [json.loads(line) for f in (rotated, path) if f.exists() for line in f.read_text().splitlines()]
+    assert [line['n'] for line in lines] == list(range(lines[0]['n'], 10))
+
+
+def test_untraced_paths_are_skipped(tmp_path, monkeypatch):
+    flask = pytest.importorskip('flask')
+    monkeypatch.setattr(tracing, 'TRACING_ENABLED', True)
+    path = tmp_path / 'traces.jsonl'
+    monkeypatch.setattr(tracing, '_exporter', tracing.FileSpanExporter(str(path)))
+
+    app = flask.Flask(__name__)
+    app.add_url_rule('/api/ok', 'ok', lambda: 'ok')
+    app.add_url_rule('/static/app.js', 'asset', lambda: 'js')
+    tracing.init_flask_app(app, service_name='test')
+
+    client = app.test_client()
+    assert 'X-Trace-Id' not in client.get('/static/app.js').headers
+    assert 'X-Trace-Id' in client.get('/api/ok').headers
+
+    spans = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [span['name'] for span in spans] == ['GET /api/ok']
+
+
+def span(trace_id, span_id, parent_id=None, **attributes):
+    return {'trace_id': trace_id, 'span_id': span_id, 'parent_id': parent_id,
+            'name': span_id, 'start': 0, 'duration_ms': 1, 'attributes': attributes}
+
+
+def test_guest_token_trace_reparented_under_issuer():
+    spans = [
+        span('backend', 'request'),
+        span('backend', 'issue', 'request', guest_token_fp='fp1', **{'guest_token.issued': True}),
+        span('superset', 'chart-data', guest_token_fp='fp1'),
+        span('superset', 'sql', 'chart-data'),
+        # Uses the token but did not issue it; never an anchor
+        span('other', 'dashboard', guest_token_fp='fp2'),
+    ]
+    traces = waterfall.group_traces(spans)
+
+    assert sorted(traces) == ['backend', 'other']
+    by_id = {s['span_id']: s for s in traces['backend']}
+    assert set(by_id) == {'request', 'issue', 'chart-data', 'sql'}
+    assert by_id['chart-data']['parent_id'] == 'issue'
+    assert by_id['sql']['parent_id'] == 'chart-data'